@@ -0,0 +1,53 @@
+# benchmarks/compare.py
+"""
+Compare two benchmark result files.
+
+Usage:
+    python -m benchmarks.compare baseline.json candidate.json --threshold 0.1
+"""
+import argparse
+import json
+import sys
+
+def compare(baseline, candidate, threshold):
+    """
+    Pair up benchmarks by name and compute the median time ratio.
+
+    Returns:
+        list: (name, baseline median, candidate median, ratio, regressed) tuples.
+    """
+    rows = []
+    for name, stats in candidate['results'].items():
+        if name not in baseline['results']:
+            continue
+        old = baseline['results'][name]['median']
+        new = stats['median']
+        ratio = new / old if old else float('inf')
+        rows.append((name, old, new, ratio, ratio > 1 + threshold))
+    return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark JSON files.")
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--threshold', type=float, default=0.1, help="Relative slowdown that counts as a regression")
+    args = parser.parse_args()
+
+    with open(args.baseline, 'r') as f:
+        baseline = json.load(f)
+    with open(args.candidate, 'r') as f:
+        candidate = json.load(f)
+
+    rows = compare(baseline, candidate, args.threshold)
+    if not rows:
+        print("No benchmarks in common")
+        return
+    print(f"{baseline.get('commit')} -> {candidate.get('commit')}")
+    width = max(len(row[0]) for row in rows)
+    for name, old, new, ratio, regressed in rows:
+        flag = '  REGRESSION' if regressed else ''
+        print(f"{name:<{width}}  {old * 1e3:10.3f} ms  {new * 1e3:10.3f} ms  {ratio:6.2f}x{flag}")
+    sys.exit(1 if any(row[4] for row in rows) else 0)
+
+if __name__ == '__main__':
+    main()
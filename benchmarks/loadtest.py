@@ -0,0 +1,290 @@
+# benchmarks/loadtest.py
+"""
+Load test the dashboard against a stand-in OpenSky server.
+
+Starts a fake `/api/states/all` server with synthetic aircraft, optionally
+starts the app under gunicorn (the docker-compose worker setup) pointed at
+it, registers a monitored area and connects many headless Socket.IO
+clients. Reports latency from the OpenSky response to client receipt,
+ingest throughput, server CPU and memory, and messages dropped per client.
+
+Usage:
+    python -m benchmarks.loadtest --spawn-server --database-uri sqlite:////tmp/load.db --aircraft 2000 --clients 200
+    python -m benchmarks.loadtest --target http://localhost:5000 --opensky-port 8081   # app started with OPENSKY_URL
+"""
+import argparse
+import json
+import math
+import os
+import random
+import re
+import statistics
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import requests
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+class FakeOpenSky:
+    """
+    Serves `/api/states/all` for a fleet of synthetic aircraft.
+
+    Each aircraft flies a fixed heading through the requested bounding box,
+    wrapping at its edges. The wall-clock time each payload timestamp was
+    served is kept so clients can measure end-to-end latency.
+    """
+
+    def __init__(self, aircraft, port, seed=0):
+        rng = random.Random(seed)
+        self.aircraft = [
+            {
+                'icao24': f"{i:06x}",
+                'u': rng.random(), 'v': rng.random(),
+                'du': rng.uniform(-0.002, 0.002), 'dv': rng.uniform(-0.002, 0.002),
+                'alt': rng.choice([300, 800, 1500, 11000]) + rng.uniform(-50, 50),
+                'vel': rng.uniform(30, 250)
+            }
+            for i in range(aircraft)
+        ]
+        self.served_at = {}
+        self.requests = 0
+        self._lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), self._handler())
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/api/states/all"
+
+    def payload(self, lamin, lamax, lomin, lomax):
+        now = int(time.time())
+        with self._lock:
+            self.requests += 1
+            states = []
+            for a in self.aircraft:
+                a['u'] = (a['u'] + a['du']) % 1
+                a['v'] = (a['v'] + a['dv']) % 1
+                lat = lamin + a['u'] * (lamax - lamin)
+                lon = lomin + a['v'] * (lomax - lomin)
+                states.append([a['icao24'], None, 'XX', now, now, lon, lat, a['alt'], False, a['vel'],
+                               math.degrees(math.atan2(a['dv'], a['du'])) % 360, 0, None, a['alt'], None, False, 0])
+            self.served_at.setdefault(now, time.time())
+        return {'time': now, 'states': states}
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                if url.path != '/api/states/all':
+                    self.send_error(404)
+                    return
+                q = {k: float(v[0]) for k, v in parse_qs(url.query).items()}
+                body = json.dumps(fake.payload(q.get('lamin', 45), q.get('lamax', 50),
+                                               q.get('lomin', 0), q.get('lomax', 5))).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True, name="fake_opensky").start()
+
+    def stop(self):
+        self.server.shutdown()
+
+class DashboardClient:
+    """Headless dashboard: a Socket.IO client recording every flight update it receives."""
+
+    def __init__(self, target, served_at):
+        import socketio
+        self.served_at = served_at
+        self.latencies = []
+        self.received = set()
+        self.messages = 0
+        self.sio = socketio.Client(reconnection=False)
+        self.sio.on('flight_batch_update', self._on_batch)
+        self.target = target
+
+    def _on_batch(self, data):
+        now = time.time()
+        self.messages += 1
+        for flight in data.get('flights', []):
+            if not flight.get('points'):
+                continue
+            ts = flight['points'][-1][2]
+            self.received.add((flight['flight_id'], ts))
+            served = self.served_at.get(ts)
+            if served is not None:
+                self.latencies.append(now - served)
+
+    def connect(self):
+        # Websocket only, like the dashboard: polling needs sticky sessions across workers
+        self.sio.connect(self.target, transports=['websocket'], wait_timeout=30)
+
+    def disconnect(self):
+        try:
+            self.sio.disconnect()
+        except Exception:
+            pass
+
+def process_usage(pid):
+    """CPU seconds and RSS bytes for pid and its children, read from /proc (Linux only)."""
+    pids = [pid]
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children", 'r') as f:
+            pids += [int(p) for p in f.read().split()]
+    except OSError:
+        pass
+    cpu, rss = 0.0, 0
+    for p in pids:
+        try:
+            with open(f"/proc/{p}/stat", 'r') as f:
+                fields = f.read().rsplit(')', 1)[1].split()
+            cpu += (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+            with open(f"/proc/{p}/status", 'r') as f:
+                match = re.search(r'VmRSS:\s+(\d+) kB', f.read())
+            rss += int(match.group(1)) * 1024 if match else 0
+        except (OSError, IndexError, ValueError):
+            continue
+    return cpu, rss
+
+def processed_flights(target):
+    """Sum of process_states_flights_total from the app's /metrics endpoint."""
+    try:
+        text = requests.get(f"{target}/metrics", timeout=10).text
+    except requests.RequestException:
+        return None
+    return sum(float(line.rsplit(' ', 1)[1]) for line in text.splitlines()
+               if line.startswith('process_states_flights_total'))
+
+def spawn_server(port, database_uri, opensky_url, workers=1):
+    env = dict(os.environ, DATABASE_URL=database_uri, OPENSKY_URL=opensky_url)
+    return subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-k', 'geventwebsocket.gunicorn.workers.GeventWebSocketWorker',
+         '-w', str(workers), '--timeout', '300', '-b', f"127.0.0.1:{port}", 'flight_tracker:create_app()'],
+        env=env
+    )
+
+def wait_for(target, timeout=60):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if requests.get(f"{target}/areas", timeout=5).ok:
+                return True
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    return False
+
+def percentile(values, q):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the flight tracker with fake OpenSky data and simulated dashboards.")
+    parser.add_argument('--target', default='http://127.0.0.1:5000', help="App URL when not using --spawn-server")
+    parser.add_argument('--spawn-server', action='store_true', help="Start the app under gunicorn like docker-compose")
+    parser.add_argument('--server-port', type=int, default=5055)
+    parser.add_argument('--workers', type=int, default=1,
+                        help="gunicorn workers for --spawn-server; more than one needs a Postgres --database-uri")
+    parser.add_argument('--database-uri', default='sqlite:////tmp/flight_tracker_load.db')
+    parser.add_argument('--opensky-port', type=int, default=0, help="Port for the fake OpenSky server (0 picks one)")
+    parser.add_argument('--aircraft', type=int, default=1000)
+    parser.add_argument('--clients', type=int, default=100)
+    parser.add_argument('--duration', type=float, default=120, help="Seconds to measure for")
+    parser.add_argument('--frequency', default='30s', choices=['30s', '1m', '5m'])
+    parser.add_argument('--output', help="Write the JSON report here as well as stdout")
+    args = parser.parse_args()
+
+    fake = FakeOpenSky(args.aircraft, args.opensky_port)
+    fake.start()
+    print(f"Fake OpenSky serving {args.aircraft} aircraft at {fake.url}")
+
+    server = None
+    target = args.target
+    if args.spawn_server:
+        target = f"http://127.0.0.1:{args.server_port}"
+        server = spawn_server(args.server_port, args.database_uri, fake.url, args.workers)
+    clients = []
+    try:
+        if not wait_for(target):
+            raise SystemExit(f"App at {target} did not come up")
+
+        for _ in range(args.clients):
+            client = DashboardClient(target, fake.served_at)
+            client.connect()
+            clients.append(client)
+        print(f"Connected {len(clients)} dashboard clients")
+
+        response = requests.post(f"{target}/start_monitoring", json={
+            'lamin': 45.0, 'lamax': 50.0, 'lomin': 0.5, 'lomax': 5.0, 'frequency': args.frequency
+        }, timeout=30)
+        response.raise_for_status()
+        area_id = response.json()['area_id']
+
+        flights_before = processed_flights(target)
+        usage_before = process_usage(server.pid) if server else None
+        start = time.time()
+        time.sleep(args.duration)
+        elapsed = time.time() - start
+        usage_after = process_usage(server.pid) if server else None
+        flights_after = processed_flights(target)
+
+        requests.post(f"{target}/stop_monitoring", json={'area_id': area_id}, timeout=30)
+    finally:
+        for client in clients:
+            client.disconnect()
+        if server:
+            server.terminate()
+            try:
+                server.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                server.kill()
+                server.wait()
+        fake.stop()
+
+    delivered = set().union(*(c.received for c in clients)) if clients else set()
+    dropped = sum(len(delivered - c.received) for c in clients)
+    latencies = [l for c in clients for l in c.latencies]
+    report = {
+        'aircraft': args.aircraft,
+        'clients': len(clients),
+        'duration': elapsed,
+        'opensky_requests': fake.requests,
+        'ingest': {
+            'flights_processed': (flights_after - flights_before) if flights_before is not None and flights_after is not None else None,
+            'flights_per_second': (flights_after - flights_before) / elapsed if flights_before is not None and flights_after is not None else None,
+            'updates_delivered': len(delivered)
+        },
+        'latency_seconds': {
+            'p50': percentile(latencies, 0.5),
+            'p95': percentile(latencies, 0.95),
+            'p99': percentile(latencies, 0.99),
+            'max': max(latencies) if latencies else None,
+            'mean': statistics.mean(latencies) if latencies else None
+        },
+        'messages_received': sum(c.messages for c in clients),
+        'dropped_updates': dropped,
+        'drop_ratio': dropped / (len(delivered) * len(clients)) if delivered and clients else 0,
+        'server': {
+            'cpu_percent': 100 * (usage_after[0] - usage_before[0]) / elapsed,
+            'rss_bytes': usage_after[1]
+        } if usage_before and usage_after else None
+    }
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == '__main__':
+    main()
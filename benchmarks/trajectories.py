@@ -0,0 +1,82 @@
+# benchmarks/trajectories.py
+import math
+import random
+
+POINT_INTERVAL = 10  # Seconds between synthetic position reports
+
+def straight_cruise(n, seed=0, start_time=0):
+    """Commercial traffic: a straight line at cruise altitude and speed."""
+    rng = random.Random(seed)
+    lat, lon = 48 + rng.uniform(-2, 2), 5 + rng.uniform(-2, 2)
+    heading = rng.uniform(0, 2 * math.pi)
+    return [
+        [lat + 0.02 * i * math.cos(heading), lon + 0.02 * i * math.sin(heading),
+         start_time + i * POINT_INTERVAL, 11000 + rng.uniform(-30, 30), 230 + rng.uniform(-3, 3)]
+        for i in range(n)
+    ]
+
+def lawnmower_survey(n, seed=0, start_time=0, leg_points=12):
+    """Survey flight: parallel back-and-forth legs at low altitude."""
+    rng = random.Random(seed)
+    lat, lon = 52 + rng.uniform(-1, 1), 4 + rng.uniform(-1, 1)
+    points = []
+    for i in range(n):
+        leg, step = divmod(i, leg_points)
+        x = step if leg % 2 == 0 else leg_points - 1 - step
+        points.append([lat + 0.004 * leg, lon + 0.01 * x, start_time + i * POINT_INTERVAL,
+                       700 + rng.uniform(-20, 20), 60 + rng.uniform(-2, 2)])
+    return points
+
+def zigzag_crop_dusting(n, seed=0, start_time=0):
+    """Crop dusting: tight zig-zags just above the ground."""
+    rng = random.Random(seed)
+    lat, lon = 45 + rng.uniform(-1, 1), 1 + rng.uniform(-1, 1)
+    return [
+        [lat + 0.002 * i, lon + (0.003 if i % 2 else -0.003), start_time + i * POINT_INTERVAL,
+         60 + rng.uniform(-10, 10), 45 + rng.uniform(-2, 2)]
+        for i in range(n)
+    ]
+
+def circular_rescue(n, seed=0, start_time=0, radius=0.03):
+    """Search and rescue: repeated orbits around a fixed point."""
+    rng = random.Random(seed)
+    lat, lon = 50 + rng.uniform(-1, 1), 2 + rng.uniform(-1, 1)
+    return [
+        [lat + radius * math.sin(i / 6), lon + radius * math.cos(i / 6), start_time + i * POINT_INTERVAL,
+         400 + rng.uniform(-15, 15), 35 + rng.uniform(-2, 2)]
+        for i in range(n)
+    ]
+
+PATTERNS = {
+    'cruise': straight_cruise,
+    'survey': lawnmower_survey,
+    'crop_dusting': zigzag_crop_dusting,
+    'rescue': circular_rescue
+}
+
+def mixed_traffic(n_flights, n_points, seed=0):
+    """(flight_id, points) pairs cycling through every pattern."""
+    names = list(PATTERNS)
+    return [
+        (f"{names[i % len(names)]}{i:05d}", PATTERNS[names[i % len(names)]](n_points, seed=seed + i))
+        for i in range(n_flights)
+    ]
+
+def states_stream(flights):
+    """
+    Yield OpenSky `/states/all` payloads replaying flights one point per poll.
+
+    Args:
+        flights (list): (flight_id, points) pairs, all with the same length.
+
+    Yields:
+        dict: A payload shaped like `fetch_flight_data` output.
+    """
+    n_polls = min(len(points) for _, points in flights)
+    for i in range(n_polls):
+        states = []
+        for flight_id, points in flights:
+            lat, lon, ts, alt, vel = points[i]
+            state = [flight_id, None, None, ts, ts, lon, lat, alt, False, vel]
+            states.append(state + [None] * 7)
+        yield {'time': flights[0][1][i][2], 'states': states}
@@ -1,11 +1,27 @@
 # flight_tracker/analysis.py
-from sklearn.ensemble import RandomForestClassifier
-from sklearn.utils.validation import check_is_fitted
 import threading
 import time
-from flight_tracker.features import extract_features
+from flight_tracker.features import extract_features, shape_features
 from flight_tracker.utils import logger
-from flight_tracker.ml_model import load_model, save_model
+from flight_tracker.ml_model import get_active_model
+from flight_tracker.metrics import PREDICT_SECONDS, LOG_BUFFER_DEPTH
+
+RECLASSIFY_EVERY_POINTS = 10  # Always re-run classification after this many new points
+MIN_STABLE_POINTS = 6  # Shape features swing too much to reuse a label below this
+ALTITUDE_DRIFT = 250  # Re-run when the average altitude moves this far since the last run
+VELOCITY_DRIFT = 10  # Same for the average velocity
+BOUNDARY_MARGIN = 0.1  # Relative distance to a rule threshold that counts as near the boundary
+
+# Thresholds the rules in analyze_flight compare against; keep in sync with them
+RULE_THRESHOLDS = {
+    'avg_altitude': (1000, 2000, 5000),
+    'avg_velocity': (50, 100),
+    'turns_per_point': (0.1,),
+    'parallelism_score': (0.2,),
+    'zig_zag_count': (0.3,),
+    'circularity': (0.7,)
+}
+SHAPE_FEATURES = ('turns_per_point', 'parallelism_score', 'zig_zag_count', 'circularity')
 
 classification_log_buffer = []
 ml_failure_buffer = []
@@ -17,6 +33,8 @@ def flush_log_buffers(socketio):
     while True:
         time.sleep(5)
         with buffer_lock:
+            LOG_BUFFER_DEPTH.set(len(classification_log_buffer), buffer='classification')
+            LOG_BUFFER_DEPTH.set(len(ml_failure_buffer), buffer='ml_failure')
             if classification_log_buffer:
                 socketio.emit('log', {'message': '\n'.join(classification_log_buffer)})
                 classification_log_buffer.clear()
@@ -32,15 +50,137 @@ def start_buffer_thread(socketio):
     thread = threading.Thread(target=flush_log_buffers, args=(socketio,), daemon=True)
     thread.start()
 
-def analyze_flight(flight):
-    if not hasattr(analyze_flight, 'model'):
-        analyze_flight.model = load_model()
-        if analyze_flight.model is None:
-            logger.info("No pre-trained model found, initializing new RandomForestClassifier")
-            analyze_flight.model = RandomForestClassifier(n_estimators=100, random_state=42)
+def near_rule_boundary(features, margin=BOUNDARY_MARGIN):
+    """True if any rule feature lies within margin (relative) of one of its thresholds."""
+    for name, thresholds in RULE_THRESHOLDS.items():
+        value = features[name]
+        if any(abs(value - t) <= abs(t) * margin for t in thresholds):
+            return True
+    return False
+
+class ReclassificationPolicy:
+    """
+    Decides when a flight's classification must be recomputed.
+
+    After each full classification the result is cached with the point count,
+    the flight's average altitude and velocity, its shape features and
+    whether any rule feature sat near its threshold. Later updates reuse the
+    cached label unless `every_points` new points arrived (counted as they
+    arrive, since decimation keeps the stored count flat), the averages
+    drifted, a shape feature crossed or approached a rule threshold (checked
+    with the vectorized `shape_features`), the flight was near a rule
+    boundary, or the ML model it was labelled with was replaced.
+    """
+
+    def __init__(self, every_points=RECLASSIFY_EVERY_POINTS, altitude_drift=ALTITUDE_DRIFT,
+                 velocity_drift=VELOCITY_DRIFT, margin=BOUNDARY_MARGIN):
+        self.every_points = every_points
+        self.altitude_drift = altitude_drift
+        self.velocity_drift = velocity_drift
+        self.margin = margin
+        self.evaluated = 0
+        self.skipped = 0
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def reuse(self, flight, n_points):
+        """Apply the cached classification and return True if re-running can be skipped."""
+        points = flight.points_array
+        last_timestamp = float(points[-1, 2]) if n_points else None
+        with self._lock:
+            entry = self._cache.get(flight.flight_id)
+            if entry is not None and last_timestamp != entry['last_timestamp']:
+                entry['arrivals'] += 1
+                entry['last_timestamp'] = last_timestamp
+            if (entry is None
+                    or n_points < MIN_STABLE_POINTS
+                    or n_points < entry['points']
+                    or entry['arrivals'] >= self.every_points
+                    or entry['near_boundary']
+                    or abs(flight.avg_altitude - entry['avg_altitude']) > self.altitude_drift
+                    or abs(flight.avg_velocity - entry['avg_velocity']) > self.velocity_drift
+                    or (entry['source'] in ('ml', None) and entry['model_version'] != get_active_model()['version'])):
+                self.evaluated += 1
+                return False
+        track = (n_points, last_timestamp)
+        if track != entry['track'] and self._shape_moved(entry['shape'], shape_features(points)):
+            with self._lock:
+                self.evaluated += 1
+            return False
+        with self._lock:
+            self.skipped += 1
+        flight.classification = entry['classification']
+        flight.classification_source = entry['source']
+        flight.auto_classified = entry['auto_classified']
+        return True
+
+    def _shape_moved(self, cached, shape):
+        """True if a shape feature is now on the other side of, or within margin of, a rule threshold."""
+        for name, value in shape.items():
+            for t in RULE_THRESHOLDS[name]:
+                if (value > t) != (cached[name] > t) or abs(value - t) <= abs(t) * self.margin:
+                    return True
+        return False
+
+    def record(self, flight, n_points, features):
+        points = flight.points_array
+        last_timestamp = float(points[-1, 2]) if n_points else None
+        with self._lock:
+            self._cache[flight.flight_id] = {
+                'points': n_points,
+                'arrivals': 0,  # Points ingested since this classification
+                'last_timestamp': last_timestamp,
+                'track': (n_points, last_timestamp),
+                'shape': {name: features[name] for name in SHAPE_FEATURES} if features else None,
+                'avg_altitude': flight.avg_altitude,
+                'avg_velocity': flight.avg_velocity,
+                'near_boundary': features is None or near_rule_boundary(features, self.margin),
+                'classification': flight.classification,
+                'source': flight.classification_source,
+                'auto_classified': flight.auto_classified,
+                'model_version': get_active_model()['version']
+            }
+
+    def forget(self, flight_ids):
+        with self._lock:
+            for flight_id in flight_ids:
+                self._cache.pop(flight_id, None)
+
+    def stats(self):
+        with self._lock:
+            total = self.evaluated + self.skipped
+            return {
+                'evaluated': self.evaluated,
+                'skipped': self.skipped,
+                'skip_ratio': self.skipped / total if total else 0,
+                'cached_flights': len(self._cache)
+            }
+
+reclassification_policy = ReclassificationPolicy()
+
+def analyze_flight(flight, policy=reclassification_policy):
+    """
+    Classify a flight in place.
+
+    Args:
+        flight (FlightPath): The flight to classify.
+        policy (ReclassificationPolicy, optional): Throttling policy; pass None
+            to always run the full classification.
+    """
+    if policy is not None:
+        point_count = flight.point_count
+        if policy.reuse(flight, point_count):
+            logger.debug(f"Reused classification {flight.classification} for flight {flight.flight_id}")
+            return
+        features = _classify(flight, flight.points_list)
+        policy.record(flight, point_count, features)
+    else:
+        _classify(flight, flight.points_list)
 
-    logger.debug(f"Analyzing flight {flight.flight_id} with points: {flight.points_list}")
-    features = extract_features(flight.points_list)
+def _classify(flight, points):
+    """Run the rules and ML fallback on a flight; returns the features used."""
+    logger.debug(f"Analyzing flight {flight.flight_id} with {len(points)} points")
+    features = extract_features(points)
     if features is None:  # This should no longer happen with the updated features.py
         logger.error(f"Unexpected None from extract_features for flight {flight.flight_id}")
         flight.classification = None
@@ -75,9 +215,18 @@ def analyze_flight(flight):
         logger.debug(f"Classified flight {flight.flight_id} as 'rescue' (rule-based)")
     else:
         try:
-            check_is_fitted(analyze_flight.model)
+            active = get_active_model()
             feature_vector = list(features.values())
-            prediction = analyze_flight.model.predict([feature_vector])[0]
+            if active['forest'] is not None:
+                with PREDICT_SECONDS.time(backend='forest'):
+                    prediction = active['forest'].predict([feature_vector])[0]
+            elif active['model'] is not None:
+                from sklearn.utils.validation import check_is_fitted
+                check_is_fitted(active['model'])
+                with PREDICT_SECONDS.time(backend='sklearn'):
+                    prediction = active['model'].predict([feature_vector])[0]
+            else:
+                raise ValueError("No trained model has been activated")
             flight.classification = prediction
             flight.classification_source = 'ml'
             flight.auto_classified = True
@@ -90,4 +239,5 @@ def analyze_flight(flight):
             flight.classification = None
             flight.classification_source = None
             flight.auto_classified = False
-            logger.debug(f"ML classification failed for {flight.flight_id}: {e}, using fallback (None)")
\ No newline at end of file
+            logger.debug(f"ML classification failed for {flight.flight_id}: {e}, using fallback (None)")
+    return features
@@ -0,0 +1,194 @@
+# flight_tracker/archive.py
+import datetime
+import functools
+import glob
+import os
+import threading
+import time
+from flight_tracker.utils import logger
+from flight_tracker.coordination import ARCHIVE_LOCK, acquire, release
+
+ARCHIVE_DIR = '/data/archive'
+COMPACT_INTERVAL = 3600  # Seconds between merges of closed day partitions
+ROW_GROUP_SIZE = 65536  # Rows per row group; min/max stats per group drive predicate pushdown
+
+# pyarrow (and the pandas it pulls in) is imported on first use to keep it off the startup path
+
+@functools.lru_cache(maxsize=None)
+def _schema():
+    """One row per archived point, partitioned by UTC day of the point timestamp."""
+    import pyarrow as pa
+    return pa.schema([
+        ('flight_id', pa.string()),
+        ('timestamp', pa.int64()),
+        ('lat', pa.float64()),
+        ('lon', pa.float64()),
+        ('altitude', pa.float64()),
+        ('velocity', pa.float64()),
+        ('classification', pa.string()),
+        ('classification_source', pa.string()),
+        ('day', pa.string())
+    ])
+
+@functools.lru_cache(maxsize=None)
+def _partitioning():
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    return ds.partitioning(pa.schema([('day', pa.string())]), flavor='hive')
+
+_write_lock = threading.Lock()
+_last_compacted = 0
+
+def _day(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp, datetime.timezone.utc).strftime('%Y-%m-%d')
+
+def archive_flights(flights):
+    """
+    Append expired flights to the columnar archive.
+
+    Args:
+        flights (list): (flight_id, points, classification, classification_source)
+            tuples, points being the normalized [lat, lon, ts, alt, vel] lists.
+
+    Returns:
+        int: Number of points written.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    schema = _schema()
+    columns = {name: [] for name in schema.names}
+    for flight_id, points, classification, source in flights:
+        for p in points:
+            columns['flight_id'].append(flight_id)
+            columns['timestamp'].append(int(p[2]))
+            columns['lat'].append(float(p[0]))
+            columns['lon'].append(float(p[1]))
+            columns['altitude'].append(float(p[3]))
+            columns['velocity'].append(float(p[4]))
+            columns['classification'].append(classification)
+            columns['classification_source'].append(source)
+            columns['day'].append(_day(p[2]))
+    if not columns['flight_id']:
+        return 0
+    table = pa.table(columns, schema=schema).sort_by([('day', 'ascending'), ('timestamp', 'ascending')])
+    with _write_lock:
+        os.makedirs(ARCHIVE_DIR, exist_ok=True)
+        pq.write_to_dataset(
+            table, ARCHIVE_DIR, partitioning=_partitioning(),
+            basename_template=f"part-{time.time_ns()}-{{i}}.parquet",
+            compression='zstd', row_group_size=ROW_GROUP_SIZE,
+            existing_data_behavior='overwrite_or_ignore'
+        )
+    logger.info(f"Archived {len(flights)} flights ({table.num_rows} points)")
+    return table.num_rows
+
+def compact_archive(force=False):
+    """
+    Merge the part files of each closed day into a single sorted file.
+
+    Every cleanup writes a small part file; merging them once a day is closed
+    keeps row groups large and the file count per partition at one.
+    """
+    global _last_compacted
+    if not force and time.time() - _last_compacted < COMPACT_INTERVAL:
+        return
+    _last_compacted = time.time()
+    # Workers share the archive directory; only one may merge a day's files at a time
+    if not acquire(ARCHIVE_LOCK, 0):
+        logger.debug("Archive compaction is running in another worker")
+        return
+    try:
+        _compact_closed_days()
+    finally:
+        release(ARCHIVE_LOCK, 0)
+
+def _compact_closed_days():
+    import pyarrow.parquet as pq
+    schema = _schema()
+    today = _day(time.time())
+    with _write_lock:
+        for partition in sorted(glob.glob(os.path.join(ARCHIVE_DIR, 'day=*'))):
+            day = partition.rsplit('=', 1)[1]
+            parts = sorted(glob.glob(os.path.join(partition, 'part-*.parquet')))
+            if day >= today or len(parts) < 2:
+                continue
+            try:
+                table = pq.read_table(parts, schema=schema.remove(schema.get_field_index('day')))
+                table = table.sort_by([('timestamp', 'ascending')])
+                merged = os.path.join(partition, f"part-{time.time_ns()}-compacted.parquet")
+                tmp_path = f"{merged}.tmp"
+                pq.write_table(table, tmp_path, compression='zstd', row_group_size=ROW_GROUP_SIZE)
+                os.replace(tmp_path, merged)
+                for part in parts:
+                    os.remove(part)
+                logger.info(f"Compacted {len(parts)} archive files for {day} ({table.num_rows} points)")
+            except Exception as e:
+                logger.error(f"Failed to compact archive partition {day}: {e}")
+
+def query_archive(start=None, end=None, bbox=None, classifications=None, flight_ids=None, limit=None):
+    """
+    Read archived points, pushing filters down to partitions and row groups.
+
+    Args:
+        start, end (int, optional): Inclusive timestamp range.
+        bbox (tuple, optional): (lamin, lamax, lomin, lomax); only points inside are returned.
+        classifications (list, optional): Keep only these classifications.
+        flight_ids (list, optional): Keep only these flights.
+        limit (int, optional): Maximum number of flights returned.
+
+    Returns:
+        list: Flights as dicts with flight_id, classification, classification_source
+            and points ([lat, lon, ts, alt, vel], ordered by time).
+    """
+    if not os.path.isdir(ARCHIVE_DIR):
+        return []
+    import pyarrow.dataset as ds
+    # An explicit schema keeps filters valid when no part files exist yet
+    dataset = ds.dataset(ARCHIVE_DIR, format='parquet', partitioning=_partitioning(), schema=_schema())
+    filters = []
+    if start is not None:
+        filters.append(ds.field('day') >= _day(start))
+        filters.append(ds.field('timestamp') >= start)
+    if end is not None:
+        filters.append(ds.field('day') <= _day(end))
+        filters.append(ds.field('timestamp') <= end)
+    if bbox is not None:
+        lamin, lamax, lomin, lomax = bbox
+        filters += [ds.field('lat') >= lamin, ds.field('lat') <= lamax,
+                    ds.field('lon') >= lomin, ds.field('lon') <= lomax]
+    if classifications:
+        filters.append(ds.field('classification').isin(classifications))
+    if flight_ids:
+        filters.append(ds.field('flight_id').isin(flight_ids))
+    expression = None
+    for f in filters:
+        expression = f if expression is None else expression & f
+    if limit is not None:
+        # Pick the first flights from the id column alone so only their points are materialized
+        import pyarrow.compute as pc
+        ids = pc.unique(dataset.to_table(columns=['flight_id'], filter=expression).column('flight_id'))
+        ids = pc.array_take(ids, pc.array_sort_indices(ids))[:limit]
+        if len(ids) == 0:
+            return []
+        selected = ds.field('flight_id').isin(ids)
+        expression = selected if expression is None else expression & selected
+    table = dataset.to_table(
+        columns=['flight_id', 'timestamp', 'lat', 'lon', 'altitude', 'velocity', 'classification', 'classification_source'],
+        filter=expression
+    ).sort_by([('flight_id', 'ascending'), ('timestamp', 'ascending')])
+
+    flights = []
+    current = None
+    columns = table.to_pydict()
+    for i, flight_id in enumerate(columns['flight_id']):
+        if current is None or current['flight_id'] != flight_id:
+            current = {
+                'flight_id': flight_id,
+                'classification': columns['classification'][i],
+                'classification_source': columns['classification_source'][i],
+                'points': []
+            }
+            flights.append(current)
+        current['points'].append([columns['lat'][i], columns['lon'][i], columns['timestamp'][i],
+                                  columns['altitude'][i], columns['velocity'][i]])
+    return flights
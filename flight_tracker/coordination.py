@@ -0,0 +1,297 @@
+# flight_tracker/coordination.py
+import json
+import os
+import queue
+import select
+import socket
+import threading
+import time
+from sqlalchemy import bindparam, create_engine, text
+from sqlalchemy.engine import make_url
+from flight_tracker.utils import logger
+from flight_tracker.models import SocketEvent
+from flight_tracker.metrics import FANOUT_QUEUE_DEPTH, FANOUT_DROPPED
+
+CHANNEL = 'flight_tracker'
+# First key of the two-int advisory locks; the second is the area id (or 0 for retraining)
+AREA_LOCK = 0x46540001
+RETRAIN_LOCK = 0x46540002
+ARCHIVE_LOCK = 0x46540003
+SIMILARITY_LOCK = 0x46540004
+LEADERSHIP_INTERVAL = 15  # Seconds between attempts to take over areas no worker is polling
+EVENT_RETENTION = 300  # Seconds socket_event rows are kept for slow listeners
+MAX_INLINE_PAYLOAD = 7000  # NOTIFY payloads are capped at 8000 bytes; larger events go through socket_event
+PUBLISH_QUEUE_SIZE = 1000  # Events waiting for the publisher; newer ones are dropped past this
+PUBLISH_BATCH = 100  # Events published per transaction
+
+class Coordinator:
+    """
+    Lets several app processes share one Postgres without polling an area twice.
+
+    Each area is polled only by the worker holding its session-level advisory
+    lock, taken on a dedicated connection so the lock lives exactly as long as
+    that worker. Flight events are published with NOTIFY and re-emitted by
+    every worker to its own Socket.IO clients, from a publisher thread so
+    polling never waits on the database. On other databases there is a single
+    process, every lock is granted locally and events are emitted directly.
+    """
+
+    def __init__(self, app, socketio):
+        self.app = app
+        self.socketio = socketio
+        self.uri = app.config['SQLALCHEMY_DATABASE_URI']
+        self.enabled = make_url(self.uri).get_backend_name() == 'postgresql'
+        self.worker = f"{socket.gethostname()}:{os.getpid()}"
+        self._held = set()
+        self._lock = threading.Lock()
+        self._lock_conn = None
+        self._engine = None
+        self._outbox = queue.Queue(maxsize=PUBLISH_QUEUE_SIZE)
+
+    def start(self):
+        if not self.enabled:
+            return
+        self._engine = create_engine(self.uri, pool_size=4, pool_pre_ping=True)
+        threading.Thread(target=self._listen, daemon=True, name="coordination_listener").start()
+        threading.Thread(target=self._lead, daemon=True, name="coordination_leadership").start()
+        threading.Thread(target=self._publish_outbox, daemon=True, name="coordination_publisher").start()
+        logger.info(f"Coordinating with other workers through Postgres as {self.worker}")
+
+    # Leadership
+
+    def _lock_connection(self):
+        if self._lock_conn is None:
+            conn = self._engine.raw_connection()
+            conn.driver_connection.autocommit = True
+            self._lock_conn = conn
+        return self._lock_conn
+
+    def _drop_lock_connection(self):
+        """Forget every lock; the server released them when the connection went away."""
+        with self._lock:
+            if self._held:
+                logger.warning(f"Lost coordination connection, giving up {len(self._held)} locks")
+            self._held.clear()
+            if self._lock_conn is not None:
+                try:
+                    self._lock_conn.invalidate()
+                except Exception:
+                    pass
+                self._lock_conn = None
+
+    def acquire(self, namespace, key):
+        """
+        Take a cluster-wide lock unless this worker already holds it.
+
+        Returns:
+            bool: True if the caller now owns the lock and should do the work.
+        """
+        with self._lock:
+            if (namespace, key) in self._held:
+                return False
+            if self.enabled:
+                try:
+                    cursor = self._lock_connection().cursor()
+                    cursor.execute("SELECT pg_try_advisory_lock(%s, %s)", (namespace, key))
+                    acquired = cursor.fetchone()[0]
+                    cursor.close()
+                except Exception as e:
+                    logger.error(f"Failed to take advisory lock {namespace}/{key}: {e}")
+                    acquired = False
+                if not acquired:
+                    return False
+            self._held.add((namespace, key))
+            return True
+
+    def release(self, namespace, key):
+        with self._lock:
+            if (namespace, key) not in self._held:
+                return
+            self._held.discard((namespace, key))
+            if self.enabled and self._lock_conn is not None:
+                try:
+                    cursor = self._lock_conn.cursor()
+                    cursor.execute("SELECT pg_advisory_unlock(%s, %s)", (namespace, key))
+                    cursor.close()
+                except Exception as e:
+                    logger.error(f"Failed to release advisory lock {namespace}/{key}: {e}")
+
+    def holds(self, namespace, key):
+        with self._lock:
+            return (namespace, key) in self._held
+
+    def _lead(self):
+        """Check the lock connection and take over monitored areas nobody is polling."""
+        from flight_tracker.monitoring import start_monitoring
+        while True:
+            time.sleep(LEADERSHIP_INTERVAL)
+            try:
+                with self._lock:
+                    if self._lock_conn is not None:
+                        cursor = self._lock_conn.cursor()
+                        cursor.execute("SELECT 1")
+                        cursor.close()
+            except Exception:
+                self._drop_lock_connection()
+            try:
+                start_monitoring(self.app, self.socketio, self.app.config['selected_classifications'])
+                with self._engine.begin() as conn:
+                    conn.execute(text("DELETE FROM socket_event WHERE created < :cutoff"),
+                                 {"cutoff": int(time.time()) - EVENT_RETENTION})
+            except Exception as e:
+                logger.error(f"Leadership check failed: {e}")
+
+    # Fan-out
+
+    def publish(self, event, data):
+        """Queue an event for the Socket.IO clients of every worker; never waits on the database."""
+        if not self.enabled:
+            self.socketio.emit(event, data)
+            return
+        try:
+            self._outbox.put_nowait((event, data))
+        except queue.Full:
+            # Live updates are superseded by the next poll, so shed them rather than stall ingest
+            FANOUT_DROPPED.inc()
+            return
+        FANOUT_QUEUE_DEPTH.set(self._outbox.qsize())
+
+    def _send(self, conn, event, data):
+        payload = json.dumps({'event': event, 'data': data})
+        if len(payload) > MAX_INLINE_PAYLOAD:
+            event_id = conn.execute(
+                SocketEvent.__table__.insert().returning(SocketEvent.id),
+                {"event": event, "payload": json.dumps(data), "created": int(time.time())}
+            ).scalar()
+            payload = json.dumps({'id': event_id})
+        conn.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": CHANNEL, "payload": payload})
+
+    def _publish_outbox(self):
+        """Publish queued events, up to PUBLISH_BATCH per transaction."""
+        while True:
+            batch = [self._outbox.get()]
+            while len(batch) < PUBLISH_BATCH:
+                try:
+                    batch.append(self._outbox.get_nowait())
+                except queue.Empty:
+                    break
+            FANOUT_QUEUE_DEPTH.set(self._outbox.qsize())
+            try:
+                with self._engine.begin() as conn:
+                    for event, data in batch:
+                        self._send(conn, event, data)
+            except Exception as e:
+                FANOUT_DROPPED.inc(len(batch))
+                logger.error(f"Failed to publish {len(batch)} events to other workers: {e}")
+                time.sleep(1)
+
+    def _listen(self):
+        while True:
+            conn = None
+            try:
+                conn = self._engine.raw_connection()
+                pg = conn.driver_connection
+                pg.autocommit = True
+                cursor = pg.cursor()
+                cursor.execute(f"LISTEN {CHANNEL}")
+                cursor.close()
+                while True:
+                    if select.select([pg], [], [], 5) == ([], [], []):
+                        continue
+                    pg.poll()
+                    messages = [json.loads(n.payload) for n in pg.notifies]
+                    pg.notifies.clear()
+                    self._dispatch(messages)
+            except Exception as e:
+                logger.error(f"Coordination listener failed, reconnecting: {e}")
+                if conn is not None:
+                    try:
+                        conn.invalidate()
+                    except Exception:
+                        pass
+                time.sleep(1)
+
+    def _dispatch(self, messages):
+        stored = [m['id'] for m in messages if 'id' in m]
+        rows = {}
+        if stored:
+            with self._engine.connect() as conn:
+                rows = {
+                    row.id: (row.event, json.loads(row.payload))
+                    for row in conn.execute(
+                        text("SELECT id, event, payload FROM socket_event WHERE id IN :ids").bindparams(
+                            bindparam('ids', expanding=True)),
+                        {"ids": stored}
+                    )
+                }
+        for message in messages:
+            if 'id' in message:
+                if message['id'] not in rows:
+                    continue
+                event, data = rows[message['id']]
+            else:
+                event, data = message['event'], message['data']
+            if event == 'control':
+                self._apply_control(data)
+            else:
+                self.socketio.emit(event, data)
+
+    # Shared settings
+
+    def control(self, kind, value):
+        """Apply a setting change here and in every other worker."""
+        if self.enabled:
+            # Settings must reach every worker, so publish them directly rather than through the sheddable outbox
+            with self._engine.begin() as conn:
+                self._send(conn, 'control', {'kind': kind, 'value': value})
+        else:
+            self._apply_control({'kind': kind, 'value': value})
+
+    def _apply_control(self, message):
+        kind, value = message['kind'], message['value']
+        if kind == 'classifications':
+            # Monitoring threads hold a reference to this set, so update it in place
+            selected = self.app.config['selected_classifications']
+            selected.clear()
+            selected.update(value)
+            logger.info(f"Updated selected classifications: {selected}")
+        elif kind == 'model':
+            from flight_tracker.ml_model import activate_model
+            activate_model(value)
+        elif kind == 'geofences':
+            from flight_tracker.geofence import reload_geofences
+            reload_geofences(self.app)
+
+coordinator = None
+
+def start_coordination(app, socketio):
+    global coordinator
+    if coordinator is None:
+        coordinator = Coordinator(app, socketio)
+        coordinator.start()
+    return coordinator
+
+def broadcast(socketio, event, data):
+    """Emit to every worker's clients, or straight to socketio when not coordinating."""
+    if coordinator is None:
+        socketio.emit(event, data)
+    else:
+        coordinator.publish(event, data)
+
+def acquire(namespace, key):
+    return coordinator is None or coordinator.acquire(namespace, key)
+
+def release(namespace, key):
+    if coordinator is not None:
+        coordinator.release(namespace, key)
+
+def holds(namespace, key):
+    return coordinator is None or coordinator.holds(namespace, key)
+
+def control(kind, value):
+    if coordinator is not None:
+        coordinator.control(kind, value)
+
+def worker_name():
+    """This worker's name when it shares the database with others, else None."""
+    return coordinator.worker if coordinator is not None and coordinator.enabled else None
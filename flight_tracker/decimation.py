@@ -0,0 +1,104 @@
+# flight_tracker/decimation.py
+import json
+import math
+import os
+from flight_tracker.utils import logger
+from flight_tracker.metrics import DECIMATED_POINTS
+
+# Retention per classification; anything not listed keeps every point.
+#   min_interval: seconds after which a point is always kept (one point per N seconds)
+#   max_reports: most position reports one stored segment may span, however often they arrive;
+#     2 drops at most every other report, so the track stays evenly sampled for circularity
+#     and segment_length_std
+#   tolerance_km: a point further than this from the line through its neighbours is kept
+#   altitude_tolerance: same for metres off the altitude interpolated between its neighbours
+#   heading_tolerance: same for degrees of heading change at the point, measured like the
+#     segment angles of extract_features; 10 keeps every turn its parallelism score can see
+#   min_points: tracks shorter than this keep every point; the shape features are counts per
+#     point, so dropping points from a short track moves them however straight it is
+DEFAULT_POLICIES = {
+    'commercial': {'min_interval': 60, 'max_reports': 2, 'tolerance_km': 0.5, 'altitude_tolerance': 150,
+                   'heading_tolerance': 10, 'min_points': 150}
+}
+POLICY_KEYS = ('min_interval', 'max_reports', 'tolerance_km', 'altitude_tolerance', 'heading_tolerance', 'min_points')
+
+def load_policies():
+    """Policies from the DECIMATION_POLICIES environment variable (JSON), else the defaults."""
+    raw = os.environ.get('DECIMATION_POLICIES')
+    if raw is None:
+        return dict(DEFAULT_POLICIES)
+    try:
+        policies = json.loads(raw)
+        for name, policy in policies.items():
+            if not isinstance(policy, dict) or not set(policy) <= set(POLICY_KEYS):
+                raise ValueError(f"{name}: expected an object with {', '.join(POLICY_KEYS)}")
+            if all(policy.get(key) is None for key in POLICY_KEYS):
+                raise ValueError(f"{name}: set at least one limit, or leave it out to keep every point")
+            for key, value in policy.items():
+                if value is not None and (not isinstance(value, (int, float)) or value < 0):
+                    raise ValueError(f"{name}.{key} must be a non-negative number or null")
+    except (ValueError, AttributeError) as e:
+        logger.error(f"Ignoring invalid DECIMATION_POLICIES, using defaults: {e}")
+        return dict(DEFAULT_POLICIES)
+    logger.info(f"Track decimation policies: {policies}")
+    return policies
+
+policies = load_policies()
+
+def _offset_km(anchor, tail, head):
+    """Distance from tail to the anchor-head segment on a local flat projection."""
+    kx = 111.32 * math.cos(math.radians(anchor[0]))
+    ky = 110.57
+    bx, by = (head[1] - anchor[1]) * kx, (head[0] - anchor[0]) * ky
+    px, py = (tail[1] - anchor[1]) * kx, (tail[0] - anchor[0]) * ky
+    length2 = bx * bx + by * by
+    t = max(0.0, min(1.0, (px * bx + py * by) / length2)) if length2 > 0 else 0.0
+    return math.hypot(px - t * bx, py - t * by)
+
+def _heading_change(anchor, tail, head):
+    """Degrees between the anchor-tail and tail-head segments, in raw lat/lon as extract_features measures them."""
+    before = math.degrees(math.atan2(tail[0] - anchor[0], tail[1] - anchor[1]))
+    after = math.degrees(math.atan2(head[0] - tail[0], head[1] - tail[1]))
+    return abs((after - before + 180) % 360 - 180)
+
+def redundant_tail(flight, points, new_point):
+    """
+    Whether new_point can replace the flight's last stored point instead of following it.
+
+    Runs as each point arrives, so the latest position is always kept: the
+    previous one is dropped when the track has min_points, the previous one
+    is within min_interval and max_reports of the point before it, and it is
+    on the line (heading and altitude profile) from that point to
+    new_point. Only rule-classified flights are decimated; the ML model
+    sees every shape feature, so those flights keep full fidelity.
+
+    Args:
+        flight (FlightPath): The flight, with the classification from its last update.
+        points (list): Its current points, sorted by time.
+        new_point (list): [lat, lon, ts, alt, vel] about to be added.
+    """
+    policy = policies.get(flight.classification)
+    if not policy or flight.classification_source != 'rule' or len(points) < max(2, policy.get('min_points') or 0):
+        return False
+    anchor, tail = points[-2], points[-1]
+    if not anchor[2] < tail[2] < new_point[2]:
+        return False
+    min_interval = policy.get('min_interval')
+    if min_interval is not None and tail[2] - anchor[2] >= min_interval:
+        return False
+    max_reports = policy.get('max_reports')
+    if max_reports is not None and new_point[2] - anchor[2] > max_reports * (new_point[2] - tail[2]):
+        return False
+    tolerance = policy.get('tolerance_km')
+    if tolerance is not None and _offset_km(anchor, tail, new_point) > tolerance:
+        return False
+    heading_tolerance = policy.get('heading_tolerance')
+    if heading_tolerance is not None and _heading_change(anchor, tail, new_point) > heading_tolerance:
+        return False
+    altitude_tolerance = policy.get('altitude_tolerance')
+    if altitude_tolerance is not None and min(anchor[3], tail[3], new_point[3]) != -1:
+        expected = anchor[3] + (new_point[3] - anchor[3]) * (tail[2] - anchor[2]) / (new_point[2] - anchor[2])
+        if abs(tail[3] - expected) > altitude_tolerance:
+            return False
+    DECIMATED_POINTS.inc(classification=flight.classification)
+    return True
@@ -99,4 +99,79 @@ def extract_features(points):
         'altitude_variability': np.std([a for a in altitudes if a != -1]) if any(a != -1 for a in altitudes) else 0
     }
     logger.debug(f"Extracted features for points {len(valid_points)}: {features}")
-    return features
\ No newline at end of file
+    return features
+
+def shape_features(latlon):
+    """
+    The shape features the classification rules compare, vectorized.
+
+    Gives the same turns_per_point, parallelism_score, zig_zag_count and
+    circularity as extract_features, at a fraction of its cost, so callers
+    can cheaply tell whether a cached classification has gone stale.
+
+    Args:
+        latlon (np.ndarray): (n, 2+) array of points, lat and lon first.
+
+    Returns:
+        dict: Feature name to value.
+    """
+    latlon = np.asarray(latlon, dtype=np.float64)[:, :2]
+    n = len(latlon)
+    features = {'turns_per_point': 0.0, 'parallelism_score': 0.0, 'circularity': 0.0, 'zig_zag_count': 0.0}
+    if n < 2:
+        return features
+    steps = np.diff(latlon, axis=0)
+    if n > 2:
+        v1, v2 = steps[:-1], steps[1:]
+        mags = np.sqrt((v1 ** 2).sum(axis=1)) * np.sqrt((v2 ** 2).sum(axis=1))
+        moving = mags > 0
+        cos_angle = (v1 * v2).sum(axis=1)[moving] / mags[moving]
+        features['turns_per_point'] = np.count_nonzero(cos_angle < 0.7) / n
+    if n > 3:
+        angles = np.arctan2(steps[:, 0], steps[:, 1]) * 180 / np.pi
+        parallel = np.abs((angles[:-2] - angles[2:] + 180) % 360 - 180) < 10
+        features['parallelism_score'] = np.count_nonzero(parallel) / n
+        if len(angles) > 2:
+            diff = np.abs((angles[1:] - angles[:-1] + 180) % 360 - 180)
+            features['zig_zag_count'] = np.count_nonzero((diff > 45) & (diff < 135)) / n
+    if n > 5:
+        u = latlon[:, 1] - latlon[:, 1].mean()
+        v = latlon[:, 0] - latlon[:, 0].mean()
+        spread = (u * u).sum() + (v * v).sum()
+        if spread > 0:
+            radius = np.sqrt(spread / n)
+            features['circularity'] = 1 - np.abs(np.sqrt(u * u + v * v) - radius).mean() / radius
+    return features
+
+def feature_vector(points):
+    """
+    The values of extract_features, in the same order, from an (n, 5) points array.
+
+    Vectorized with shape_features, for callers that need the features of
+    many flights at once.
+
+    Returns:
+        np.ndarray: float64 vector of the 8 features.
+    """
+    points = np.asarray(points, dtype=np.float64)
+    if len(points) == 0:
+        return np.array([-1, -1, 0, 0, 0, 0, 0, 0], dtype=np.float64)
+    altitudes, velocities = points[:, 3], points[:, 4]
+    known_altitudes = altitudes[altitudes != -1]
+    shape = shape_features(points)
+    segment_std = 0.0
+    if len(points) > 1:
+        steps = np.diff(points[:, :2], axis=0)
+        dx = steps[:, 1] * 111.32 * np.cos(points[:-1, 0] * np.pi / 180)
+        dy = steps[:, 0] * 111.32
+        segment_std = np.std(np.sqrt(dx ** 2 + dy ** 2))
+    return np.array([
+        altitudes.mean() if len(known_altitudes) else -1,
+        velocities.mean() if np.any(velocities != -1) else -1,
+        shape['turns_per_point'],
+        shape['parallelism_score'],
+        shape['circularity'],
+        shape['zig_zag_count'],
+        segment_std,
+        np.std(known_altitudes) if len(known_altitudes) else 0
+    ])
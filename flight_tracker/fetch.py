@@ -1,25 +1,43 @@
 # flight_tracker/fetch.py
-import requests
 import configparser
+import datetime
+import os
+import time
+from sqlalchemy.dialects import postgresql, sqlite
 from flight_tracker.utils import logger
+from flight_tracker.models import db, CreditUsage
+from flight_tracker.metrics import FETCH_SECONDS, FETCH_TOTAL, FETCHED_STATES, CREDITS_USED
 
-BASE_URL = "https://opensky-network.org/api/states/all"
+BASE_URL = os.environ.get('OPENSKY_URL', "https://opensky-network.org/api/states/all")
 CONFIG_PATH = '/root/.config/pyopensky/settings.conf'
+FETCH_TIMEOUT = 30  # Seconds an OpenSky request may take
+POLL_INTERVALS = {'30s': 30, '1m': 60, '5m': 300}  # Seconds between polls of an area per frequency setting
 
-# Load OpenSky credentials
-config = configparser.ConfigParser()
-try:
-    config.read(CONFIG_PATH)
-    USERNAME = config['opensky']['username']
-    PASSWORD = config['opensky']['password']
-except KeyError as e:
-    logger.error(f"Missing OpenSky credentials in {CONFIG_PATH}: {e}")
-    raise
-except Exception as e:
-    logger.error(f"Failed to read config file {CONFIG_PATH}: {e}")
-    raise
+def poll_interval(frequency):
+    return POLL_INTERVALS.get(frequency, 30)
 
-credits_used = 0
+_credentials = None
+
+def get_credentials():
+    """
+    Read the OpenSky credentials on first use, so the app starts without them.
+
+    Returns:
+        tuple or None: (username, password), or None if the config file is missing or incomplete.
+    """
+    global _credentials
+    if _credentials is None:
+        config = configparser.ConfigParser()
+        try:
+            config.read(CONFIG_PATH)
+            _credentials = (config['opensky']['username'], config['opensky']['password'])
+        except KeyError as e:
+            logger.error(f"Missing OpenSky credentials in {CONFIG_PATH}: {e}")
+        except Exception as e:
+            logger.error(f"Failed to read config file {CONFIG_PATH}: {e}")
+    return _credentials
+
+credits_used = 0  # Today's total across all workers, as last read from credit_usage
 MAX_CREDITS = 4000  # Daily credit limit
 
 def calculate_credit_cost(lamin, lamax, lomin, lomax):
@@ -42,6 +60,40 @@ def calculate_credit_cost(lamin, lamax, lomin, lomax):
     else:
         return 4
 
+def _today():
+    return datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%d')
+
+def get_credits_used():
+    """Credits spent today (UTC) by every worker."""
+    global credits_used
+    credits_used = db.session.query(CreditUsage.used).filter_by(day=_today()).scalar() or 0
+    return credits_used
+
+def charge_credits(cost):
+    """
+    Add cost to today's shared credit total in one atomic statement.
+
+    Returns:
+        int: The new total.
+    """
+    global credits_used
+    session = db.session
+    dialect = session.get_bind().dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        insert = postgresql.insert if dialect == 'postgresql' else sqlite.insert
+        statement = insert(CreditUsage).values(day=_today(), used=cost)
+        statement = statement.on_conflict_do_update(
+            index_elements=['day'], set_={'used': CreditUsage.used + statement.excluded.used}
+        ).returning(CreditUsage.used)
+        credits_used = session.execute(statement).scalar()
+    else:
+        usage = session.get(CreditUsage, _today()) or CreditUsage(day=_today(), used=0)
+        usage.used += cost
+        session.add(usage)
+        credits_used = usage.used
+    session.commit()
+    return credits_used
+
 def fetch_flight_data(area):
     """
     Fetch flight states from OpenSky Network API for a given monitored area.
@@ -52,11 +104,16 @@ def fetch_flight_data(area):
     Returns:
         dict or None: API response data or None if fetch fails or credits exceeded.
     """
-    global credits_used
+    import requests
+    credentials = get_credentials()
+    if credentials is None:
+        FETCH_TOTAL.inc(result='no_credentials')
+        return None
     cost = calculate_credit_cost(area.lamin, area.lamax, area.lomin, area.lomax)
     
-    if credits_used + cost > MAX_CREDITS:
+    if get_credits_used() + cost > MAX_CREDITS:
         logger.warning(f"Credit limit reached ({credits_used}/{MAX_CREDITS}). Skipping fetch for area {area.id}")
+        FETCH_TOTAL.inc(result='credit_limit')
         return None
     
     params = {
@@ -66,13 +123,19 @@ def fetch_flight_data(area):
         "lomax": area.lomax
     }
     
+    response = None
     try:
-        response = requests.get(BASE_URL, params=params, auth=(USERNAME, PASSWORD), timeout=30)
+        start = time.perf_counter()
+        response = requests.get(BASE_URL, params=params, auth=credentials, timeout=FETCH_TIMEOUT)
+        FETCH_SECONDS.observe(time.perf_counter() - start, stage='request')
         response.raise_for_status()
+        start = time.perf_counter()
         states = response.json()
+        FETCH_SECONDS.observe(time.perf_counter() - start, stage='parse')
         
         if not states or 'states' not in states or states['states'] is None:
             logger.warning(f"Invalid API response for area {area.id}: {states}")
+            FETCH_TOTAL.inc(result='invalid')
             return None
         
         states_count = len(states['states'])
@@ -87,13 +150,18 @@ def fetch_flight_data(area):
                 valid_states.append(state)
         states['states'] = valid_states
         
-        credits_used += cost
+        charge_credits(cost)
+        CREDITS_USED.set(credits_used)
+        FETCH_TOTAL.inc(result='ok')
+        FETCHED_STATES.inc(len(valid_states))
         logger.info(f"Credits used: {credits_used}/{MAX_CREDITS}")
         return states
     
     except requests.RequestException as e:
-        if response.status_code == 429:
+        if response is not None and response.status_code == 429:
+            FETCH_TOTAL.inc(result='rate_limited')
             logger.warning(f"OpenSky API rate limit exceeded: {response.text}")
         else:
+            FETCH_TOTAL.inc(result='error')
             logger.error(f"Failed to fetch data for area {area.id}: {e}")
         return None
\ No newline at end of file
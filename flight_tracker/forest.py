@@ -0,0 +1,136 @@
+# flight_tracker/forest.py
+import json
+import os
+import shutil
+import numpy as np
+
+# Arrays making up a flattened forest, one .npy file each so they can be memory mapped
+_ARRAYS = ('feature', 'threshold', 'left', 'right', 'missing_left', 'value', 'roots')
+
+class FlatForest:
+    """
+    A fitted RandomForestClassifier flattened into contiguous node arrays.
+
+    All trees share one set of node arrays; `roots` holds the index of each
+    tree's root. Leaves point at themselves, so walking every tree for a fixed
+    `max_depth` steps leaves each row on its leaf without per-node branching.
+    Predictions match `RandomForestClassifier.predict` exactly.
+    """
+
+    def __init__(self, feature, threshold, left, right, missing_left, value, roots, classes, max_depth):
+        self.feature = feature
+        self.threshold = threshold
+        self.left = left
+        self.right = right
+        self.missing_left = missing_left
+        self.value = value
+        self.roots = roots
+        self.classes = classes
+        self.max_depth = max_depth
+
+    @classmethod
+    def from_sklearn(cls, model):
+        """
+        Flatten a fitted forest.
+
+        Args:
+            model (RandomForestClassifier): The fitted classifier.
+
+        Returns:
+            FlatForest: The flattened forest.
+        """
+        features, thresholds, lefts, rights, missing, values, roots = [], [], [], [], [], [], []
+        offset = 0
+        max_depth = 0
+        n_classes = len(model.classes_)
+        for estimator in model.estimators_:
+            tree = estimator.tree_
+            n = tree.node_count
+            is_leaf = tree.children_left == -1
+            own = np.arange(offset, offset + n, dtype=np.int32)
+            features.append(np.where(is_leaf, 0, tree.feature).astype(np.int32))
+            thresholds.append(np.where(is_leaf, np.inf, tree.threshold).astype(np.float64))
+            lefts.append(np.where(is_leaf, own, tree.children_left + offset).astype(np.int32))
+            rights.append(np.where(is_leaf, own, tree.children_right + offset).astype(np.int32))
+            if hasattr(tree, 'missing_go_to_left'):
+                missing.append(np.asarray(tree.missing_go_to_left, dtype=bool))
+            else:
+                missing.append(np.zeros(n, dtype=bool))
+            # Same normalization as DecisionTreeClassifier.predict_proba
+            leaf_value = tree.value[:, 0, :n_classes].astype(np.float64)
+            normalizer = leaf_value.sum(axis=1, keepdims=True)
+            normalizer[normalizer == 0.0] = 1.0
+            values.append(leaf_value / normalizer)
+            roots.append(offset)
+            max_depth = max(max_depth, tree.max_depth)
+            offset += n
+        return cls(
+            feature=np.concatenate(features),
+            threshold=np.concatenate(thresholds),
+            left=np.concatenate(lefts),
+            right=np.concatenate(rights),
+            missing_left=np.concatenate(missing),
+            value=np.ascontiguousarray(np.concatenate(values)),
+            roots=np.asarray(roots, dtype=np.int32),
+            classes=np.asarray(model.classes_),
+            max_depth=max_depth
+        )
+
+    def leaves(self, X):
+        """Return the leaf index reached in every tree, shape (n_rows, n_trees)."""
+        # sklearn compares float32 inputs against float64 thresholds
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim == 1:
+            X = X.reshape(1, -1)
+        rows = np.arange(X.shape[0])[:, None]
+        node = np.broadcast_to(self.roots, (X.shape[0], len(self.roots))).copy()
+        for _ in range(self.max_depth):
+            x = X[rows, self.feature[node]]
+            go_left = (x <= self.threshold[node]) | (np.isnan(x) & self.missing_left[node])
+            node = np.where(go_left, self.left[node], self.right[node])
+        return node
+
+    def predict_proba(self, X):
+        node = self.leaves(X)
+        proba = np.zeros((node.shape[0], self.value.shape[1]))
+        # Accumulate tree by tree in the same order as sklearn so ties break identically
+        for t in range(node.shape[1]):
+            proba += self.value[node[:, t]]
+        proba /= node.shape[1]
+        return proba
+
+    def predict(self, X):
+        return self.classes.take(np.argmax(self.predict_proba(X), axis=1))
+
+    def save(self, path):
+        """Write the forest as a directory of .npy files, replacing path atomically."""
+        tmp_path = f"{path}.tmp.{os.getpid()}"
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        for name in _ARRAYS:
+            np.save(os.path.join(tmp_path, f"{name}.npy"), getattr(self, name))
+        np.save(os.path.join(tmp_path, 'classes.npy'), self.classes.astype(str))
+        with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+            json.dump({'max_depth': int(self.max_depth)}, f)
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """
+        Load a saved forest.
+
+        Args:
+            path (str): Directory written by `save`.
+            mmap (bool): Memory map the node arrays instead of reading them, so
+                forked workers share the pages.
+
+        Returns:
+            FlatForest: The loaded forest.
+        """
+        mode = 'r' if mmap else None
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mode) for name in _ARRAYS}
+        with open(os.path.join(path, 'meta.json'), 'r') as f:
+            meta = json.load(f)
+        classes = np.load(os.path.join(path, 'classes.npy')).astype(object)
+        return cls(classes=classes, max_depth=meta['max_depth'], **arrays)
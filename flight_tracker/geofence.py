@@ -0,0 +1,274 @@
+# flight_tracker/geofence.py
+import json
+import math
+import threading
+import time
+from flight_tracker.utils import logger
+from flight_tracker.models import db, MonitoredArea, Geofence, GeofencePresence
+from flight_tracker.metrics import GEOFENCE_EVENTS, GEOFENCE_FENCES
+from flight_tracker.coordination import broadcast, worker_name
+from flight_tracker.fetch import FETCH_TIMEOUT, poll_interval
+
+GRID_DEGREES = 0.5  # Cell size of the uniform grid fences are bucketed into
+MAX_FENCE_CELLS = 4096  # Larger fences skip the grid and are checked against every point
+# A flight unseen for (MISSED_POLLS + 1) polls of the slowest monitored area, each as long as
+# its interval plus a timed-out fetch, plus STALE_MARGIN, has left every fence it was in
+MISSED_POLLS = 1
+STALE_MARGIN = 60
+MAINTENANCE_INTERVAL = 10  # Seconds between sweeps for stale flights and exchanges of fence members
+PRESENCE_TTL = 3 * MAINTENANCE_INTERVAL  # Members published by a worker that stopped refreshing them are dropped
+
+def stale_seconds(intervals):
+    """Seconds without a position after which a flight polled at the given intervals is gone."""
+    slowest = max(intervals, default=poll_interval(None))
+    return (MISSED_POLLS + 1) * (slowest + FETCH_TIMEOUT) + STALE_MARGIN
+
+class Fence:
+    """A monitored area's bounding box or a user polygon, keyed 'area:<id>' or 'polygon:<id>'."""
+    __slots__ = ('key', 'name', 'lamin', 'lamax', 'lomin', 'lomax', 'polygon')
+
+    def __init__(self, key, name, lamin, lamax, lomin, lomax, polygon=None):
+        self.key = key
+        self.name = name
+        self.lamin, self.lamax, self.lomin, self.lomax = lamin, lamax, lomin, lomax
+        self.polygon = polygon
+
+    @classmethod
+    def from_area(cls, area):
+        return cls(f"area:{area.id}", area.name, area.lamin, area.lamax, area.lomin, area.lomax)
+
+    @classmethod
+    def from_polygon(cls, key, name, polygon):
+        polygon = [(float(p[0]), float(p[1])) for p in polygon]
+        if len(polygon) < 3:
+            raise ValueError("A polygon needs at least 3 points")
+        lats = [p[0] for p in polygon]
+        lons = [p[1] for p in polygon]
+        return cls(key, name, min(lats), max(lats), min(lons), max(lons), polygon)
+
+    def contains(self, lat, lon):
+        if not (self.lamin <= lat <= self.lamax and self.lomin <= lon <= self.lomax):
+            return False
+        if self.polygon is None:
+            return True
+        # Ray casting along the latitude line
+        inside = False
+        polygon = self.polygon
+        lat_j, lon_j = polygon[-1]
+        for lat_i, lon_i in polygon:
+            if (lat_i > lat) != (lat_j > lat) and lon < (lon_j - lon_i) * (lat - lat_i) / (lat_j - lat_i) + lon_i:
+                inside = not inside
+            lat_j, lon_j = lat_i, lon_i
+        return inside
+
+    def to_dict(self):
+        return {
+            'fence': self.key,
+            'name': self.name,
+            'lamin': self.lamin,
+            'lamax': self.lamax,
+            'lomin': self.lomin,
+            'lomax': self.lomax,
+            'polygon': [list(p) for p in self.polygon] if self.polygon else None
+        }
+
+class GeofenceEngine:
+    """
+    Tracks which fences each flight is inside as its points are ingested.
+
+    Fences are bucketed into a uniform grid of GRID_DEGREES cells, so a point
+    is only tested against the fences overlapping its cell. Only flights
+    currently inside some fence are remembered, and per-fence members are
+    kept up to date as flights enter, leave or go stale. Each worker only
+    sees the flights of the areas it polls, so live counts also include the
+    members other workers publish (see share_presence).
+    """
+
+    def __init__(self, cell=GRID_DEGREES):
+        self.cell = cell
+        self.fences = {}
+        self.stale_seconds = stale_seconds(())
+        self._grid = {}
+        self._large = []
+        self._inside = {}  # flight_id -> set of fence keys
+        self._last_seen = {}
+        self._members = {}  # fence key -> flight ids inside it, from this worker
+        self._remote = {}  # fence key -> flight ids inside it, from the other workers
+        self._lock = threading.Lock()
+
+    def _cell(self, lat, lon):
+        return math.floor(lat / self.cell), math.floor(lon / self.cell)
+
+    def set_fences(self, fences):
+        """Replace the fence set, keeping memberships of fences that still exist."""
+        grid, large = {}, []
+        for fence in fences:
+            i0, j0 = self._cell(fence.lamin, fence.lomin)
+            i1, j1 = self._cell(fence.lamax, fence.lomax)
+            if (i1 - i0 + 1) * (j1 - j0 + 1) > MAX_FENCE_CELLS:
+                large.append(fence)
+                continue
+            for i in range(i0, i1 + 1):
+                for j in range(j0, j1 + 1):
+                    grid.setdefault((i, j), []).append(fence)
+        with self._lock:
+            self.fences = {fence.key: fence for fence in fences}
+            self._grid, self._large = grid, large
+            members = {key: set() for key in self.fences}
+            for flight_id, keys in list(self._inside.items()):
+                keys.intersection_update(self.fences)
+                if not keys:
+                    del self._inside[flight_id]
+                    self._last_seen.pop(flight_id, None)
+                for key in keys:
+                    members[key].add(flight_id)
+            self._members = members
+        GEOFENCE_FENCES.set(len(fences))
+
+    def reload(self, session):
+        """Load the fences from every monitored area and stored polygon, and the stale window from the polled ones."""
+        areas = session.query(MonitoredArea).all()
+        self.stale_seconds = stale_seconds([poll_interval(area.frequency) for area in areas if area.is_monitoring])
+        fences = [Fence.from_area(area) for area in areas]
+        for geofence in session.query(Geofence).all():
+            try:
+                fences.append(Fence.from_polygon(f"polygon:{geofence.id}", geofence.name, json.loads(geofence.polygon)))
+            except (ValueError, TypeError, IndexError) as e:
+                logger.error(f"Skipping invalid geofence {geofence.id}: {e}")
+        self.set_fences(fences)
+        logger.debug(f"Loaded {len(fences)} geofences")
+
+    def update(self, flight_id, lat, lon, timestamp, events):
+        """
+        Check a newly ingested point against the fences around it.
+
+        Args:
+            events (dict): Collects flight ids per ('area_enter' | 'area_exit', fence key).
+        """
+        with self._lock:
+            now_inside = {fence.key for fence in self._grid.get(self._cell(lat, lon), ()) if fence.contains(lat, lon)}
+            for fence in self._large:
+                if fence.contains(lat, lon):
+                    now_inside.add(fence.key)
+            before = self._inside.get(flight_id)
+            if now_inside:
+                self._inside[flight_id] = now_inside
+                self._last_seen[flight_id] = timestamp
+            elif before is None:
+                return
+            else:
+                del self._inside[flight_id]
+                del self._last_seen[flight_id]
+            before = before or set()
+            self._record(flight_id, now_inside - before, before - now_inside, events)
+
+    def expire(self, now, events):
+        """Take flights that haven't reported for stale_seconds out of their fences."""
+        with self._lock:
+            cutoff = now - self.stale_seconds
+            for flight_id in [f for f, seen in self._last_seen.items() if seen < cutoff]:
+                del self._last_seen[flight_id]
+                self._record(flight_id, (), self._inside.pop(flight_id), events)
+
+    def _record(self, flight_id, entered, exited, events):
+        for key in entered:
+            self._members[key].add(flight_id)
+            events.setdefault(('area_enter', key), []).append(flight_id)
+        for key in exited:
+            self._members[key].discard(flight_id)
+            events.setdefault(('area_exit', key), []).append(flight_id)
+
+    def _count(self, key):
+        members, remote = self._members.get(key, ()), self._remote.get(key)
+        return len(members | remote) if remote else len(members)
+
+    def count(self, key):
+        """Flights inside a fence now, across every worker."""
+        with self._lock:
+            return self._count(key)
+
+    def members(self):
+        """This worker's flights inside each fence that has any."""
+        with self._lock:
+            return {key: sorted(flight_ids) for key, flight_ids in self._members.items() if flight_ids}
+
+    def set_remote(self, remote):
+        """Replace the members other workers published, as fence key -> set of flight ids."""
+        with self._lock:
+            self._remote = remote
+
+    def snapshot(self):
+        """Every fence with the number of flights inside it now."""
+        with self._lock:
+            return [dict(fence.to_dict(), count=self._count(key)) for key, fence in self.fences.items()]
+
+geofence_engine = GeofenceEngine()
+
+def emit_events(socketio, events, timestamp):
+    """One area_enter/area_exit event per fence with the flights that crossed it and its live count."""
+    for (event, key), flight_ids in events.items():
+        fence = geofence_engine.fences.get(key)
+        broadcast(socketio, event, {
+            'fence': key,
+            'name': fence.name if fence else None,
+            'flight_ids': flight_ids,
+            'count': geofence_engine.count(key),
+            'timestamp': timestamp
+        })
+        GEOFENCE_EVENTS.inc(len(flight_ids), event=event)
+
+def reload_geofences(app):
+    with app.app_context():
+        geofence_engine.reload(db.session)
+
+def share_presence(session, worker, now):
+    """
+    Publish this worker's fence members and pick up everyone else's.
+
+    Rows of workers that stopped refreshing them for PRESENCE_TTL are removed,
+    so a worker that died stops counting.
+    """
+    members = geofence_engine.members()
+    session.query(GeofencePresence).filter(
+        (GeofencePresence.worker == worker) | (GeofencePresence.updated < now - PRESENCE_TTL)
+    ).delete(synchronize_session=False)
+    session.add_all(
+        GeofencePresence(worker=worker, fence=key, flight_ids=json.dumps(flight_ids), updated=now)
+        for key, flight_ids in members.items()
+    )
+    session.commit()
+    remote = {}
+    rows = session.query(GeofencePresence.fence, GeofencePresence.flight_ids).filter(GeofencePresence.worker != worker)
+    for key, flight_ids in rows:
+        remote.setdefault(key, set()).update(json.loads(flight_ids))
+    geofence_engine.set_remote(remote)
+
+def _maintain_geofences(app, socketio):
+    """
+    Expire flights that stopped reporting and exchange fence members with the other workers.
+
+    Runs on its own timer rather than from process_states, so flights still
+    expire when no area is being polled.
+    """
+    while True:
+        time.sleep(MAINTENANCE_INTERVAL)
+        now = int(time.time())
+        try:
+            events = {}
+            geofence_engine.expire(now, events)
+            worker = worker_name()
+            if worker is not None:
+                with app.app_context():
+                    try:
+                        share_presence(db.session, worker, now)
+                    finally:
+                        db.session.close()
+            if events:
+                emit_events(socketio, events, now)
+        except Exception as e:
+            logger.error(f"Geofence maintenance failed: {e}")
+
+def start_geofence_maintenance(app, socketio):
+    thread = threading.Thread(target=_maintain_geofences, args=(app, socketio), daemon=True, name="geofence_maintenance")
+    thread.start()
+    return thread
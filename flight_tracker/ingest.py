@@ -0,0 +1,298 @@
+# flight_tracker/ingest.py
+import atexit
+import json
+import os
+import queue
+import threading
+import time
+from sqlalchemy import delete, text, tuple_
+from sqlalchemy.dialects import postgresql, sqlite
+from flight_tracker.utils import logger
+from flight_tracker.models import db, FlightPath, FlightPosition
+from flight_tracker.metrics import (
+    INGEST_QUEUE_DEPTH, INGEST_COMMIT_SECONDS, INGEST_COMMIT_SIZE, INGEST_BACKPRESSURE, INGEST_COMMIT_FAILURES,
+    INGEST_DEAD_LETTERS
+)
+
+SPOOL_PATH = '/data/ingest_spool.jsonl'  # Changes that could not be committed at shutdown
+DEAD_LETTER_PATH = '/data/ingest_dead_letter.jsonl'  # Changes the database rejected on their own; not replayed
+MAX_PENDING = 20000  # Queued flight changes before producers block
+FLUSH_SIZE = 1000  # Group-commit once this many changes are queued...
+FLUSH_INTERVAL = 1.0  # ...or this many seconds after the first one arrived
+MAX_RETRIES = 5
+
+FLIGHT_COLUMNS = [column.name for column in FlightPath.__table__.columns]
+
+def flight_change(flight, new_point, dropped_point=None):
+    """
+    Snapshot of a flight's columns plus the position row for the point just added.
+
+    Args:
+        dropped_point (list, optional): Stored point decimation replaced with new_point,
+            whose playback position row is deleted.
+    """
+    change = {column: getattr(flight, column) for column in FLIGHT_COLUMNS}
+    change['positions'] = [FlightPosition.row(flight.flight_id, new_point)]
+    if dropped_point is not None:
+        row = FlightPosition.row(flight.flight_id, dropped_point)
+        change['dropped_positions'] = [[row['bucket'], row['flight_id'], row['timestamp']]]
+    return change
+
+def flight_from_change(change):
+    """Detached FlightPath carrying the state of a queued change."""
+    flight = FlightPath(change['flight_id'])
+    for column in FLIGHT_COLUMNS:
+        setattr(flight, column, change[column])
+    return flight
+
+def _insert(dialect, table):
+    return (postgresql.insert if dialect == 'postgresql' else sqlite.insert)(table)
+
+def insert_positions(session, rows):
+    """Add rows to the flight_position index, ignoring points another thread already stored."""
+    if not rows:
+        return
+    dialect = session.get_bind().dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        session.execute(_insert(dialect, FlightPosition).on_conflict_do_nothing(), rows)
+    else:
+        session.bulk_insert_mappings(FlightPosition, rows)
+
+def write_changes(session, changes):
+    """
+    Write queued flight changes in one statement per table; the caller commits.
+
+    Later changes to the same flight replace earlier ones, and all of their
+    positions are kept.
+    """
+    latest = {}
+    positions = []
+    dropped = set()
+    for change in changes:
+        latest[change['flight_id']] = change
+        positions.extend(change['positions'])
+        dropped.update(tuple(key) for key in change.get('dropped_positions', ()))
+    if dropped:
+        # Points decimated within this batch are never written at all
+        positions = [p for p in positions if (p['bucket'], p['flight_id'], p['timestamp']) not in dropped]
+    rows = [{column: change[column] for column in FLIGHT_COLUMNS} for change in latest.values()]
+    dialect = session.get_bind().dialect.name
+    if dialect in ('postgresql', 'sqlite'):
+        statement = _insert(dialect, FlightPath)
+        statement = statement.on_conflict_do_update(
+            index_elements=['flight_id'],
+            set_={column: statement.excluded[column] for column in FLIGHT_COLUMNS if column != 'flight_id'}
+        )
+        session.execute(statement, rows)
+    else:
+        for row in rows:
+            session.merge(flight_from_change(row))
+    insert_positions(session, positions)
+    if dropped:
+        session.execute(delete(FlightPosition).where(
+            tuple_(FlightPosition.bucket, FlightPosition.flight_id, FlightPosition.timestamp).in_(list(dropped))
+        ))
+
+class WriteBehindQueue:
+    """
+    Bounded queue of flight changes drained by one writer thread.
+
+    The writer group-commits everything queued within FLUSH_INTERVAL (or up
+    to FLUSH_SIZE changes) from every area in a single transaction. Producers
+    block when MAX_PENDING changes are waiting, and read their own
+    not-yet-committed writes back through `pending`.
+    """
+
+    def __init__(self, app, max_pending=MAX_PENDING, flush_size=FLUSH_SIZE, flush_interval=FLUSH_INTERVAL):
+        self.app = app
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._replay_spool()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="ingest_writer")
+        self._thread.start()
+        atexit.register(self.stop)
+        logger.info("Started write-behind ingest queue")
+
+    def put(self, change):
+        with self._pending_lock:
+            self._pending[change['flight_id']] = change
+        if self._queue.full():
+            INGEST_BACKPRESSURE.inc()
+        self._queue.put(change)
+        INGEST_QUEUE_DEPTH.set(self._queue.qsize())
+
+    def pending(self, flight_id):
+        """The latest queued but uncommitted change for a flight, if any."""
+        with self._pending_lock:
+            return self._pending.get(flight_id)
+
+    def depth(self):
+        return self._queue.qsize()
+
+    def stop(self, timeout=30):
+        """Flush everything still queued; spool it to disk if the database is unavailable."""
+        if self._stopping.is_set():
+            return
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+        leftover = []
+        while True:
+            try:
+                leftover.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        if leftover and not self._commit(leftover, retries=1):
+            self._spool(leftover)
+        logger.info("Write-behind ingest queue stopped")
+
+    def _run(self):
+        while True:
+            try:
+                batch = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                if self._stopping.is_set():
+                    return
+                continue
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.flush_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            INGEST_QUEUE_DEPTH.set(self._queue.qsize())
+            # Keep retrying while running so a database outage backs up into the
+            # producers; only spool to disk once shutting down
+            while not self._commit(batch, retries=MAX_RETRIES):
+                if self._stopping.is_set():
+                    self._spool(batch)
+                    break
+                if self._database_up():
+                    # The database answers but rejects the batch: commit what it will take on its own
+                    self._isolate(batch)
+                    break
+            if self._stopping.is_set() and self._queue.empty():
+                return
+
+    def _database_up(self):
+        with self.app.app_context():
+            try:
+                db.session.execute(text("SELECT 1"))
+                return True
+            except Exception:
+                return False
+            finally:
+                db.session.close()
+
+    def _isolate(self, batch):
+        """Commit each change of a failing batch alone and dead-letter the ones that still fail."""
+        rejected = [change for change in batch if not self._commit([change], retries=1, backoff=False)]
+        if rejected:
+            INGEST_DEAD_LETTERS.inc(len(rejected))
+            self._spool(rejected, DEAD_LETTER_PATH)
+        logger.warning(f"Committed {len(batch) - len(rejected)} changes of a failing batch one by one, "
+                       f"dead-lettered {len(rejected)}")
+
+    def _commit(self, batch, retries, backoff=True):
+        for attempt in range(retries):
+            start = time.perf_counter()
+            with self.app.app_context():
+                session = db.session
+                try:
+                    write_changes(session, batch)
+                    session.commit()
+                except Exception as e:
+                    session.rollback()
+                    INGEST_COMMIT_FAILURES.inc()
+                    logger.error(f"Group commit of {len(batch)} changes failed (attempt {attempt + 1}/{retries}): {e}")
+                    # Shutting down: spool now rather than sit out the backoff
+                    if not backoff or self._stopping.wait(min(2 ** attempt, 10)):
+                        return False
+                    continue
+                finally:
+                    session.close()
+            INGEST_COMMIT_SECONDS.observe(time.perf_counter() - start)
+            INGEST_COMMIT_SIZE.observe(len(batch))
+            self._release(batch)
+            return True
+        return False
+
+    def _release(self, batch):
+        with self._pending_lock:
+            for change in batch:
+                if self._pending.get(change['flight_id']) is change:
+                    del self._pending[change['flight_id']]
+
+    def _spool(self, batch, path=None):
+        path = path or SPOOL_PATH
+        try:
+            with open(path, 'a') as f:
+                for change in batch:
+                    f.write(json.dumps(change) + '\n')
+            logger.warning(f"Spooled {len(batch)} uncommitted changes to {path}")
+        except OSError as e:
+            logger.error(f"Lost {len(batch)} flight changes, could not spool them: {e}")
+        self._release(batch)
+
+    def _replay_spool(self):
+        if not os.path.exists(SPOOL_PATH):
+            return
+        try:
+            with open(SPOOL_PATH, 'r') as f:
+                changes = [json.loads(line) for line in f if line.strip()]
+            os.remove(SPOOL_PATH)
+        except (OSError, json.JSONDecodeError) as e:
+            logger.error(f"Failed to read ingest spool {SPOOL_PATH}: {e}")
+            return
+        for change in changes:
+            self.put(change)
+        logger.info(f"Re-queued {len(changes)} spooled flight changes")
+
+write_queue = None
+
+def load_flight(session, flight_id):
+    """
+    Current state of a flight for the producer, including changes not yet committed.
+
+    Returns:
+        FlightPath: Detached from the session so edits never autoflush, or None.
+    """
+    if write_queue is not None:
+        change = write_queue.pending(flight_id)
+        if change is not None:
+            return flight_from_change(change)
+    flight = session.get(FlightPath, flight_id)
+    if flight is not None:
+        session.expunge(flight)
+    return flight
+
+def submit(changes):
+    """Hand flight changes to the write-behind queue, or write them inline when it isn't running."""
+    if write_queue is not None:
+        for change in changes:
+            write_queue.put(change)
+        return
+    session = db.session
+    try:
+        write_changes(session, changes)
+        session.commit()
+    except Exception:
+        session.rollback()
+        raise
+
+def start_write_behind(app):
+    global write_queue
+    if write_queue is None:
+        write_queue = WriteBehindQueue(app)
+        write_queue.start()
+    return write_queue
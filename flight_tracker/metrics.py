@@ -0,0 +1,179 @@
+# flight_tracker/metrics.py
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+
+# Default latency buckets in seconds, from sub-millisecond predicts to slow OpenSky fetches
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# Buckets for sizes such as flights per emit or queue lengths
+SIZE_BUCKETS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+def _label_key(labelnames, labels):
+    if set(labels) != set(labelnames):
+        raise ValueError(f"Expected labels {labelnames}, got {tuple(labels)}")
+    return tuple(str(labels[name]) for name in labelnames)
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labelnames, key, extra=None):
+    pairs = list(zip(labelnames, key))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+class Counter:
+    """Monotonically increasing count, optionally split by labels."""
+
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield self.name + _format_labels(self.labelnames, key), value
+
+class Gauge(Counter):
+    """Value that can go up and down, such as a queue depth."""
+
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        with self._lock:
+            self._values[key] = value
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+class Histogram:
+    """Fixed-bucket histogram with Prometheus cumulative bucket semantics."""
+
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._values = {}  # label key -> [per-bucket counts (+Inf last), sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(self.labelnames, labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(key)
+            if entry is None:
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            entry[0][index] += 1
+            entry[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observe the wall time spent in the with-block."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = {key: (list(counts), total) for key, (counts, total) in self._values.items()}
+        for key, (counts, total) in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                yield self.name + '_bucket' + _format_labels(self.labelnames, key, ('le', _format_value(float(bound)))), cumulative
+            yield self.name + '_sum' + _format_labels(self.labelnames, key), total
+            yield self.name + '_count' + _format_labels(self.labelnames, key), cumulative
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric):
+                    raise ValueError(f"Metric {metric.name} already registered as a {existing.kind}")
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        """Return all metrics in the Prometheus text exposition format."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for sample, value in metric.samples():
+                lines.append(f"{sample} {_format_value(value)}")
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+# Hot-path metrics, shared by the modules that record them
+FETCH_SECONDS = registry.histogram('opensky_fetch_seconds', "Time spent fetching states from OpenSky by stage", ['stage'])
+FETCH_TOTAL = registry.counter('opensky_fetch_total', "OpenSky fetch attempts by result", ['result'])
+FETCHED_STATES = registry.counter('opensky_states_fetched_total', "Valid aircraft states returned by OpenSky")
+CREDITS_USED = registry.gauge('opensky_credits_used', "OpenSky API credits used today")
+PROCESS_STAGE_SECONDS = registry.histogram('process_states_stage_seconds', "Time per process_states call spent in each stage", ['stage'])
+PROCESS_SECONDS = registry.histogram('process_states_seconds', "Total time per process_states call")
+PROCESSED_FLIGHTS = registry.counter('process_states_flights_total', "Aircraft states handled by process_states", ['result'])
+UPDATE_BUFFER_DEPTH = registry.histogram('process_states_update_buffer_depth', "Flight updates buffered before each emit", buckets=SIZE_BUCKETS)
+CLEANUP_SECONDS = registry.histogram('cleanup_old_flights_seconds', "Time spent deleting expired flights")
+CLEANED_FLIGHTS = registry.counter('cleanup_old_flights_deleted_total', "Flights removed by cleanup_old_flights")
+PREDICT_SECONDS = registry.histogram('model_predict_seconds', "Time per ML predict call", ['backend'])
+EMIT_FLIGHTS = registry.histogram('socket_emit_flights', "Flights per Socket.IO emit", ['event'], buckets=SIZE_BUCKETS)
+LOG_BUFFER_DEPTH = registry.gauge('log_buffer_depth', "Messages waiting in the classification log buffers", ['buffer'])
+MONITOR_TICK_SECONDS = registry.histogram('monitor_tick_seconds', "Wall time of one monitor_area iteration, excluding the sleep")
+MONITORING_THREADS = registry.gauge('monitoring_threads', "Running area monitoring threads")
+INGEST_QUEUE_DEPTH = registry.gauge('ingest_queue_depth', "Flight changes waiting for the write-behind writer")
+INGEST_COMMIT_SECONDS = registry.histogram('ingest_commit_seconds', "Time per write-behind group commit")
+INGEST_COMMIT_SIZE = registry.histogram('ingest_commit_changes', "Flight changes per write-behind group commit", buckets=SIZE_BUCKETS)
+INGEST_BACKPRESSURE = registry.counter('ingest_backpressure_total', "Enqueues that found the write-behind queue full and blocked")
+INGEST_COMMIT_FAILURES = registry.counter('ingest_commit_failures_total', "Failed write-behind group commit attempts")
+INGEST_DEAD_LETTERS = registry.counter('ingest_dead_letters_total', "Flight changes the database kept rejecting, set aside in the dead-letter file")
+STARTUP_SECONDS = registry.gauge('startup_seconds', "Startup time by phase; first_request is from package import to the first request", ['phase'])
+SIMILARITY_SECONDS = registry.histogram('similarity_search_seconds', "Time per similarity query by stage", ['stage'])
+SIMILARITY_INDEXED = registry.gauge('similarity_index_flights', "Flights in the trajectory similarity index")
+GEOFENCE_EVENTS = registry.counter('geofence_events_total', "Aircraft entering or leaving a geofence", ['event'])
+GEOFENCE_FENCES = registry.gauge('geofences', "Monitored areas and polygons checked by the geofence engine")
+DECIMATED_POINTS = registry.counter('decimated_points_total', "Stored points replaced by a newer one under their classification's retention policy", ['classification'])
+FANOUT_QUEUE_DEPTH = registry.gauge('fanout_queue_depth', "Socket.IO events waiting to be published to the other workers")
+FANOUT_DROPPED = registry.counter('fanout_dropped_total', "Socket.IO events dropped because the cross-worker publish queue was full")
@@ -1,54 +1,401 @@
-import pickle
+import atexit
+import json
+import multiprocessing
 import os
-from sklearn.ensemble import RandomForestClassifier
+import pickle
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
 from flight_tracker.utils import logger
 from flight_tracker.models import db, FlightPath
 from flight_tracker.features import extract_features
+from flight_tracker.forest import FlatForest
+from flight_tracker.coordination import RETRAIN_LOCK, acquire, release, control
+
+MODEL_DIR = '/data/models'
+ACTIVE_POINTER_PATH = os.path.join(MODEL_DIR, 'active.json')
+LEGACY_MODEL_PATH = '/data/flight_model.pkl'
+FEATURE_CACHE_PATH = os.path.join(MODEL_DIR, 'feature_cache.pkl')
+RETRAIN_POLL_INTERVAL = 1  # Seconds between checks on a background retrain
+TRAIN_YIELD_PER = 500  # Rows fetched per round trip when streaming training data
+PARALLEL_FEATURE_THRESHOLD = 50  # Fewer uncached flights than this are extracted inline
+N_ESTIMATORS = 100
+WARM_START_TREES = 20  # Trees added to the active forest on an incremental retrain
+MAX_ESTIMATORS = 300  # Past this size the forest is refit from scratch
+
+# The live model and its metadata. Readers take a reference to this dict and
+# never mutate it; activating a new version replaces the whole dict, so a swap
+# is a single atomic rebinding and in-flight predictions keep their model.
+_active = None
+_active_lock = threading.Lock()
+
+_retrain_process = None
+_retrain_lock = threading.Lock()
+
+def _model_path(version):
+    return os.path.join(MODEL_DIR, f"model_v{version:04d}.pkl")
+
+def _metadata_path(version):
+    return os.path.join(MODEL_DIR, f"model_v{version:04d}.json")
+
+def _forest_path(version):
+    return os.path.join(MODEL_DIR, f"model_v{version:04d}_forest")
+
+def _atomic_write(path, data, mode='w'):
+    """Write to a temporary file next to path and rename it into place."""
+    tmp_path = f"{path}.tmp.{os.getpid()}"
+    with open(tmp_path, mode) as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+def list_versions():
+    """Return metadata for every model version in the registry, oldest first."""
+    if not os.path.isdir(MODEL_DIR):
+        return []
+    versions = []
+    for name in os.listdir(MODEL_DIR):
+        if name.startswith('model_v') and name.endswith('.json'):
+            try:
+                with open(os.path.join(MODEL_DIR, name), 'r') as f:
+                    versions.append(json.load(f))
+            except (OSError, json.JSONDecodeError) as e:
+                logger.warning(f"Skipping unreadable model metadata {name}: {e}")
+    return sorted(versions, key=lambda m: m['version'])
+
+def get_active_version():
+    """Return the version number the registry pointer marks as active, or None."""
+    try:
+        with open(ACTIVE_POINTER_PATH, 'r') as f:
+            return json.load(f)['version']
+    except FileNotFoundError:
+        return None
+    except (OSError, KeyError, json.JSONDecodeError) as e:
+        logger.error(f"Failed to read active model pointer: {e}")
+        return None
+
+def set_active_version(version):
+    """Atomically point the registry at a saved model version."""
+    if not os.path.exists(_model_path(version)):
+        raise ValueError(f"Model version {version} does not exist")
+    _atomic_write(ACTIVE_POINTER_PATH, json.dumps({'version': version}))
+    logger.info(f"Active model version set to {version}")
 
-MODEL_PATH = '/data/flight_model.pkl'
+def load_model(version=None):
+    """
+    Load a model version from the registry.
 
-def load_model():
-    """Load the saved model from disk."""
-    if os.path.exists(MODEL_PATH):
+    Args:
+        version (int, optional): Version to load. Defaults to the active version.
+
+    Returns:
+        dict or None: Model and its metadata, or None if nothing could be loaded.
+    """
+    if version is None:
+        version = get_active_version()
+    if version is None:
+        if os.path.exists(LEGACY_MODEL_PATH):
+            try:
+                with open(LEGACY_MODEL_PATH, 'rb') as f:
+                    model = pickle.load(f)
+                logger.info("Legacy model loaded from disk")
+                return {'model': model, 'forest': None, 'version': 0, 'trained_at': None, 'samples': 0, 'classes': 0}
+            except Exception as e:
+                logger.error(f"Failed to load legacy model: {e}")
+                return None
+        logger.info("No saved model found, returning None")
+        return None
+    try:
+        with open(_metadata_path(version), 'r') as f:
+            metadata = json.load(f)
+        with open(_model_path(version), 'rb') as f:
+            model = pickle.load(f)
+        logger.info(f"Model version {version} loaded from disk")
+        return dict(metadata, model=model, forest=None)
+    except Exception as e:
+        logger.error(f"Failed to load model version {version}: {e}")
+        return None
+
+def _load_live_model(version=None):
+    """
+    Load a model version for inference.
+
+    Prefers the memory-mapped flattened forest and only unpickles the sklearn
+    model when no export exists (legacy models or a failed export).
+    """
+    if version is None:
+        version = get_active_version()
+    if version is not None and os.path.isdir(_forest_path(version)):
         try:
-            with open(MODEL_PATH, 'rb') as f:
-                model = pickle.load(f)
-                logger.info("Model loaded from disk")
-                return model
+            with open(_metadata_path(version), 'r') as f:
+                metadata = json.load(f)
+            forest = FlatForest.load(_forest_path(version), mmap=True)
+            logger.info(f"Compiled forest for model version {version} mapped from disk")
+            return dict(metadata, model=None, forest=forest)
         except Exception as e:
-            logger.error(f"Failed to load model: {e}")
-            return None
-    logger.info("No saved model found, returning None")
-    return None
+            logger.error(f"Failed to load compiled forest for version {version}: {e}")
+    return load_model(version)
+
+def save_model(model, samples=0, classes=0):
+    """
+    Save a fitted model as a new registry version.
+
+    Args:
+        model: The fitted classifier.
+        samples (int): Number of training samples.
+        classes (int): Number of distinct classes.
 
-def save_model(model):
-    """Save the model to disk."""
+    Returns:
+        int or None: The new version number, or None if saving failed.
+    """
     try:
-        with open(MODEL_PATH, 'wb') as f:
-            pickle.dump(model, f)
-        logger.info("Model saved to disk")
+        os.makedirs(MODEL_DIR, exist_ok=True)
+        version = max((m['version'] for m in list_versions()), default=0) + 1
+        metadata = {
+            'version': version,
+            'trained_at': int(time.time()),
+            'samples': samples,
+            'classes': classes
+        }
+        _atomic_write(_model_path(version), pickle.dumps(model), mode='wb')
+        from sklearn.ensemble import RandomForestClassifier
+        if isinstance(model, RandomForestClassifier):
+            FlatForest.from_sklearn(model).save(_forest_path(version))
+        _atomic_write(_metadata_path(version), json.dumps(metadata))
+        logger.info(f"Model version {version} saved to disk")
+        return version
     except Exception as e:
         logger.error(f"Failed to save model: {e}")
+        return None
 
-def train_model():
-    flights = FlightPath.query.filter_by(auto_classified=False).filter(FlightPath.classification.isnot(None)).all()
-    if len(flights) < 10:
-        logger.warning(f"Insufficient data: {len(flights)} flights")
-        return False
+def activate_model(version=None):
+    """
+    Load a model version and swap it into the live classifier.
+
+    Args:
+        version (int, optional): Version to activate. Defaults to the active version.
+
+    Returns:
+        dict or None: Metadata of the now-active model, or None if loading failed.
+    """
+    global _active
+    loaded = _load_live_model(version)
+    if loaded is None:
+        return None
+    with _active_lock:
+        _active = loaded
+    logger.info(f"Activated model version {loaded['version']}")
+    return {k: v for k, v in loaded.items() if k not in ('model', 'forest')}
+
+def get_active_model():
+    """Return the live model entry, loading the active version on first use."""
+    global _active
+    if _active is None:
+        with _active_lock:
+            if _active is None:
+                _active = _load_live_model() or {'model': None, 'forest': None, 'version': None, 'trained_at': None, 'samples': 0, 'classes': 0}
+    return _active
+
+def _load_feature_cache():
+    try:
+        with open(FEATURE_CACHE_PATH, 'rb') as f:
+            return pickle.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logger.warning(f"Discarding unreadable feature cache: {e}")
+        return {}
+
+def _save_feature_cache(cache):
+    try:
+        os.makedirs(MODEL_DIR, exist_ok=True)
+        _atomic_write(FEATURE_CACHE_PATH, pickle.dumps(cache), mode='wb')
+    except Exception as e:
+        logger.error(f"Failed to save feature cache: {e}")
+
+def _extract_feature_batch(points_batch):
+    """Feature vectors for a batch of raw `FlightPath.points` values (runs in worker processes)."""
+    vectors = []
+    for points in points_batch:
+        try:
+            features = extract_features(json.loads(points) if points else [])
+        except (json.JSONDecodeError, TypeError):
+            features = None
+        vectors.append([float(v) for v in features.values()] if features else None)
+    return vectors
+
+def _build_training_set():
+    """
+    Stream labeled flights and return their feature vectors and labels.
+
+    Labels are read with a server-side cursor without the points column.
+    Feature vectors are cached per (flight_id, last_updated), so points are
+    only fetched and features recomputed, in a process pool, for flights
+    that are newly labeled or have gained points since the last retrain.
+
+    Returns:
+        tuple: (X, y, recomputed) where recomputed counts the cache misses.
+    """
+    cache = _load_feature_cache()
+    fresh_cache = {}
+    samples = []  # [flight_id, label, vector or None]
+    missing, batches = [], []
+    executor = None
+
+    rows = (
+        db.session.query(FlightPath.flight_id, FlightPath.last_updated, FlightPath.classification)
+        .filter_by(auto_classified=False)
+        .filter(FlightPath.classification.isnot(None))
+        .yield_per(TRAIN_YIELD_PER)
+    )
+    for flight_id, last_updated, classification in rows:
+        cached = cache.get(flight_id)
+        if cached and cached[0] == last_updated:
+            fresh_cache[flight_id] = cached
+            samples.append([flight_id, classification, cached[1]])
+            continue
+        samples.append([flight_id, classification, None])
+        fresh_cache[flight_id] = (last_updated, None)
+        missing.append(flight_id)
+
+    try:
+        if len(missing) >= PARALLEL_FEATURE_THRESHOLD:
+            executor = ProcessPoolExecutor()
+        for i in range(0, len(missing), TRAIN_YIELD_PER):
+            batch = dict(
+                db.session.query(FlightPath.flight_id, FlightPath.points)
+                .filter(FlightPath.flight_id.in_(missing[i:i + TRAIN_YIELD_PER]))
+            )
+            flight_ids = list(batch)
+            points_batch = [batch[flight_id] for flight_id in flight_ids]
+            result = executor.submit(_extract_feature_batch, points_batch) if executor else _extract_feature_batch(points_batch)
+            batches.append((flight_ids, result))
+
+        computed = {}
+        for flight_ids, result in batches:
+            vectors = result.result() if isinstance(result, Future) else result
+            computed.update(zip(flight_ids, vectors))
+    finally:
+        if executor:
+            executor.shutdown()
 
     X, y = [], []
-    for flight in flights:
-        features = extract_features(flight.points_list)
-        if features:
-            X.append(list(features.values()))
-            y.append(flight.classification)
+    for flight_id, classification, vector in samples:
+        if vector is None:
+            vector = computed.get(flight_id)
+            fresh_cache[flight_id] = (fresh_cache[flight_id][0], vector)
+        if vector is not None:
+            X.append(vector)
+            y.append(classification)
+    _save_feature_cache({k: v for k, v in fresh_cache.items() if v[1] is not None})
+    return X, y, len(computed)
+
+def _warm_start_base(classes, n_features):
+    """Return the active model if new trees can be grown onto it, else None."""
+    base = load_model()
+    if base is None or base['model'] is None:
+        return None
+    model = base['model']
+    from sklearn.ensemble import RandomForestClassifier
+    if not isinstance(model, RandomForestClassifier) or not hasattr(model, 'estimators_'):
+        return None
+    if list(model.classes_) != sorted(classes) or model.n_features_in_ != n_features:
+        return None
+    if len(model.estimators_) + WARM_START_TREES > MAX_ESTIMATORS:
+        return None
+    return model
+
+def train_model():
+    X, y, recomputed = _build_training_set()
+    if len(X) < 10:
+        logger.warning(f"Insufficient data: {len(X)} flights")
+        return False
 
     if len(X) < 2 or len(set(y)) < 2:
         logger.warning(f"Insufficient variety: {len(X)} samples, {len(set(y))} classes")
         return False
 
-    model = RandomForestClassifier(n_estimators=100, random_state=42)
+    from sklearn.ensemble import RandomForestClassifier
+    model = _warm_start_base(set(y), len(X[0]))
+    if model is not None:
+        model.set_params(warm_start=True, n_jobs=-1, n_estimators=len(model.estimators_) + WARM_START_TREES)
+        logger.info(f"Growing existing forest to {model.n_estimators} trees")
+    else:
+        model = RandomForestClassifier(n_estimators=N_ESTIMATORS, random_state=42, n_jobs=-1, warm_start=True)
     model.fit(X, y)
-    save_model(model)
-    logger.info(f"Model trained with {len(X)} samples, {len(set(y))} classes")
-    return True
\ No newline at end of file
+    # Inference is single-row; thread dispatch costs more than it saves there
+    model.set_params(n_jobs=None)
+    version = save_model(model, samples=len(X), classes=len(set(y)))
+    if version is None:
+        return False
+    set_active_version(version)
+    logger.info(f"Model trained with {len(X)} samples, {len(set(y))} classes ({recomputed} feature vectors recomputed)")
+    return True
+
+def _retrain_worker(database_uri):
+    """Entry point of the background training process."""
+    from flask import Flask
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_uri
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    with app.app_context():
+        success = train_model()
+    raise SystemExit(0 if success else 1)
+
+def _stop_retrain():
+    """Terminate a running retrain at shutdown; it is not a daemon, so it would otherwise be waited for."""
+    process = _retrain_process
+    if process is not None and process.is_alive():
+        process.terminate()
+        process.join(5)
+
+def _watch_retrain(process):
+    global _retrain_process
+    while process.is_alive():
+        time.sleep(RETRAIN_POLL_INTERVAL)
+    process.join()
+    if process.exitcode == 0:
+        activated = activate_model()
+        if activated:
+            # Other workers swap in the same version from the shared registry
+            control('model', activated['version'])
+    else:
+        logger.warning(f"Background retrain failed (exit code {process.exitcode})")
+    with _retrain_lock:
+        _retrain_process = None
+    release(RETRAIN_LOCK, 0)
+
+def start_retrain(database_uri):
+    """
+    Train a new model version in a separate process and hot-swap it in when done.
+
+    Args:
+        database_uri (str): SQLAlchemy URI the training process reads labels from.
+
+    Returns:
+        bool: False if a retrain is already running here or in another worker, True if one was started.
+    """
+    global _retrain_process
+    with _retrain_lock:
+        if _retrain_process is not None or not acquire(RETRAIN_LOCK, 0):
+            return False
+        # Not a daemon: daemonic processes may not start the feature extraction pool
+        process = multiprocessing.get_context('spawn').Process(
+            target=_retrain_worker,
+            args=(database_uri,),
+            daemon=False,
+            name="model_retrain"
+        )
+        process.start()
+        _retrain_process = process
+        # Registered after multiprocessing's own exit hook, which joins non-daemon children, so this runs first
+        atexit.unregister(_stop_retrain)
+        atexit.register(_stop_retrain)
+    threading.Thread(target=_watch_retrain, args=(process,), daemon=True).start()
+    logger.info(f"Started background retrain (pid {process.pid})")
+    return True
+
+def is_retraining():
+    return _retrain_process is not None
@@ -1,5 +1,7 @@
 # flight_tracker/models.py
 from flask_sqlalchemy import SQLAlchemy
+from array import array
+import itertools
 import json
 from flight_tracker.utils import logger
 
@@ -16,6 +18,96 @@ class MonitoredArea(db.Model):
     is_monitoring = db.Column(db.Boolean, default=False)
     name = db.Column(db.String(50))
 
+class Geofence(db.Model):
+    """User-drawn polygon watched for aircraft entering and leaving, alongside the monitored areas."""
+    __tablename__ = 'geofence'
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50))
+    polygon = db.Column(db.Text, nullable=False)  # JSON [[lat, lon], ...], implicitly closed
+
+class GeofencePresence(db.Model):
+    """The flights a worker last saw inside a fence, so every worker can count the whole fleet."""
+    __tablename__ = 'geofence_presence'
+    worker = db.Column(db.String(100), primary_key=True)
+    fence = db.Column(db.String(40), primary_key=True)
+    flight_ids = db.Column(db.Text, nullable=False)  # JSON list
+    updated = db.Column(db.Integer, nullable=False)
+
+class PointBlock:
+    """
+    The parsed points of one flight, packed as float64 [lat, lon, ts, alt, vel] rows.
+
+    Takes about a sixth of the memory of the equivalent list of lists. Blocks
+    are never modified; FlightPath builds a new one when its points change.
+    """
+    __slots__ = ('values',)
+
+    def __init__(self, points):
+        """Pack points of exactly five numbers each; raises TypeError on any other value."""
+        self.values = array('d', itertools.chain.from_iterable(points))
+
+    def __len__(self):
+        return len(self.values) // 5
+
+    def tolist(self):
+        """
+        New [lat, lon, ts, alt, vel] lists, safe for the caller to modify.
+
+        Integral values come back as ints, so timestamps, the -1 sentinel and
+        whole numbers are written back to the points column as they arrived.
+        """
+        values = [int(v) if v.is_integer() else v for v in self.values.tolist()]
+        return [values[i:i + 5] for i in range(0, len(values), 5)]
+
+    def to_numpy(self):
+        """Read-only (n, 5) float64 view of the block, without copying."""
+        import numpy as np
+        view = np.frombuffer(self.values, dtype=np.float64).reshape(-1, 5)
+        view.flags.writeable = False
+        return view
+
+def _numeric_point(p):
+    """The point with nulls (stored by older versions) as -1, or None if it holds any other non-number."""
+    point = []
+    for v in p:
+        if v is None:
+            v = -1
+        elif isinstance(v, bool) or not isinstance(v, (int, float)):
+            return None
+        point.append(v)
+    return point
+
+def _normalize_points(flight_id, points):
+    """
+    Points as [lat, lon, ts, alt, vel] lists of numbers, and their PointBlock.
+
+    Missing values are padded with -1 and extra ones dropped. Points that
+    aren't lists or hold non-numeric values are skipped; values are only
+    checked one by one when packing the block fails.
+
+    Returns:
+        tuple: (list of points, PointBlock).
+    """
+    normalized_points = []
+    for p in points:
+        if not isinstance(p, list):
+            logger.warning(f"Invalid point format for {flight_id}: {p}")
+            continue
+        if len(p) != 5:
+            p = p[:5] + [-1] * (5 - len(p))
+        normalized_points.append(p)
+    try:
+        return normalized_points, PointBlock(normalized_points)
+    except TypeError:
+        numeric_points = []
+        for p in normalized_points:
+            point = _numeric_point(p)
+            if point is None:
+                logger.warning(f"Invalid point values for {flight_id}: {p}")
+                continue
+            numeric_points.append(point)
+        return numeric_points, PointBlock(numeric_points)
+
 class FlightPath(db.Model):
     __tablename__ = 'flight_path'
     flight_id = db.Column(db.String(20), primary_key=True)
@@ -30,52 +122,99 @@ class FlightPath(db.Model):
 
     def __init__(self, flight_id, points=None, last_updated=0):
         self.flight_id = flight_id
-        self.points = json.dumps(points) if points else None
         self.last_updated = last_updated
-        self.update_stats()
+        self.set_points(points or [])
+
+    def set_points(self, points):
+        """Store a list of points, refreshing the stats and the parsed cache without re-decoding."""
+        normalized_points, block = _normalize_points(self.flight_id, points)
+        self.points = json.dumps(normalized_points)
+        self._point_cache = (self.points, block)
+        altitudes = [p[3] for p in normalized_points if p[3] != -1]
+        velocities = [p[4] for p in normalized_points if p[4] != -1]
+        timestamps = [p[2] for p in normalized_points]
+        self.avg_altitude = sum(altitudes) / len(altitudes) if altitudes else -1
+        self.avg_velocity = sum(velocities) / len(velocities) if velocities else -1
+        self.duration = int(max(timestamps) - min(timestamps)) if len(timestamps) > 1 else 0
 
     def update_stats(self):
         try:
             points = json.loads(self.points) if isinstance(self.points, str) else self.points
             if not isinstance(points, list):
                 raise ValueError("Points must be a list")
-            normalized_points = []
-            for p in points:
-                if not isinstance(p, list):
-                    logger.warning(f"Invalid point format for {self.flight_id}: {p}")
-                    continue
-                while len(p) < 5:
-                    p.append(-1)
-                normalized_points.append(p)
-            self.points = json.dumps(normalized_points)
-            altitudes = [p[3] for p in normalized_points if p[3] != -1]
-            velocities = [p[4] for p in normalized_points if p[4] != -1]
-            timestamps = [p[2] for p in normalized_points]
-            self.avg_altitude = sum(altitudes) / len(altitudes) if altitudes else -1
-            self.avg_velocity = sum(velocities) / len(velocities) if velocities else -1
-            self.duration = max(timestamps) - min(timestamps) if len(timestamps) > 1 else 0
-        except (json.JSONDecodeError, ValueError) as e:
+            self.set_points(points)
+        except (json.JSONDecodeError, TypeError, ValueError) as e:
             logger.error(f"Error updating stats for {self.flight_id}: {e}")
-            self.points = json.dumps([])
-            self.avg_altitude = -1
-            self.avg_velocity = -1
-            self.duration = 0
+            self.set_points([])
+
+    def _parsed(self):
+        """
+        The points column as a PointBlock, decoded once per value of the column.
+
+        The cache is keyed on the identity of the stored string, so assigning
+        points (or reloading the row) invalidates it.
+        """
+        raw = self.points
+        cache = self.__dict__.get('_point_cache')
+        if cache is not None and cache[0] is raw:
+            return cache[1]
+        points = json.loads(raw) if isinstance(raw, str) else raw
+        _, block = _normalize_points(self.flight_id, points or [])
+        self._point_cache = (raw, block)
+        return block
 
     @property
     def points_list(self):
-        if self.points:
-            points = json.loads(self.points) if isinstance(self.points, str) else self.points
-            logger.debug(f"Raw points for {self.flight_id}: {points}")
-            normalized_points = []
-            for p in points:
-                if not isinstance(p, list):
-                    logger.warning(f"Invalid point format on read for {self.flight_id}: {p}")
-                    continue
-                while len(p) < 5:
-                    p.append(-1)
-                normalized_points.append(p)
-            return normalized_points
-        return []
+        return self._parsed().tolist()
+
+    @property
+    def points_array(self):
+        """Read-only (n, 5) float64 array of the points."""
+        return self._parsed().to_numpy()
+
+    @property
+    def point_count(self):
+        return len(self._parsed())
+
+POSITION_BUCKET_SECONDS = 60  # Width of the time buckets flight_position is clustered on
+
+class FlightPosition(db.Model):
+    """One row per stored point, keyed by time bucket so playback frames are range lookups."""
+    __tablename__ = 'flight_position'
+    bucket = db.Column(db.Integer, primary_key=True)
+    flight_id = db.Column(db.String(20), primary_key=True)
+    timestamp = db.Column(db.Integer, primary_key=True)
+    lat = db.Column(db.Float, nullable=False)
+    lon = db.Column(db.Float, nullable=False)
+    altitude = db.Column(db.Float, default=-1)
+    velocity = db.Column(db.Float, default=-1)
+
+    @staticmethod
+    def row(flight_id, point):
+        """Mapping for bulk inserts from a [lat, lon, ts, alt, vel] point."""
+        return {
+            'bucket': int(point[2]) // POSITION_BUCKET_SECONDS,
+            'flight_id': flight_id,
+            'timestamp': int(point[2]),
+            'lat': point[0],
+            'lon': point[1],
+            'altitude': point[3],
+            'velocity': point[4]
+        }
+
+class SocketEvent(db.Model):
+    """Socket.IO events too large for a NOTIFY payload, fanned out to other workers by id."""
+    __tablename__ = 'socket_event'
+    id = db.Column(db.BigInteger, primary_key=True)
+    event = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    created = db.Column(db.Integer, nullable=False, index=True)
+
+class CreditUsage(db.Model):
+    """OpenSky credits spent per UTC day, shared by every worker."""
+    __tablename__ = 'credit_usage'
+    day = db.Column(db.String(10), primary_key=True)
+    used = db.Column(db.Integer, nullable=False, default=0)
 
 class Classification(db.Model):
     __tablename__ = 'classification'
@@ -3,38 +3,70 @@ import threading
 import time
 from flight_tracker.utils import logger
 from flight_tracker.models import db, MonitoredArea
-from flight_tracker.fetch import fetch_flight_data
+from flight_tracker.fetch import fetch_flight_data, poll_interval
 from flight_tracker.processing import process_states, cleanup_old_flights
+from flight_tracker.metrics import MONITORING_THREADS, MONITOR_TICK_SECONDS
+from flight_tracker.profiling import record_slow_tick
+from flight_tracker.coordination import AREA_LOCK, acquire, holds, release
 
 def monitor_area(app, socketio, area, frequency, selected_classifications):
     last_update_time = 0
     update_interval = 10  # Send updates every 10 seconds
     while True:
+        tick_start = time.perf_counter()
+        stages = {}
         with app.app_context():
             session = db.session
             try:
                 current_area = session.get(MonitoredArea, area.id)
-                if not current_area or not current_area.is_monitoring:
-                    logger.info(f"Area ID {area.id} no longer exists or stopped, stopping thread")
-                    if area.id in app.config['monitoring_threads']:
-                        del app.config['monitoring_threads'][area.id]
+                if not current_area or not current_area.is_monitoring or not holds(AREA_LOCK, area.id):
+                    if holds(AREA_LOCK, area.id):
+                        logger.info(f"Area ID {area.id} no longer exists or stopped, stopping thread")
+                    else:
+                        logger.warning(f"Lost the poller lock for area ID {area.id}, stopping thread")
+                    app.config['monitoring_threads'].pop(area.id, None)
+                    release(AREA_LOCK, area.id)
+                    MONITORING_THREADS.dec()
                     break
+                stages['area_lookup'] = time.perf_counter() - tick_start
+                start = time.perf_counter()
                 states = fetch_flight_data(current_area)
+                stages['fetch'] = time.perf_counter() - start
                 if states:
                     current_time = time.time()
                     if current_time - last_update_time >= update_interval:
-                        process_states(states, socketio, selected_classifications)
+                        start = time.perf_counter()
+                        process_stages = process_states(states, socketio, selected_classifications)
+                        stages['process'] = time.perf_counter() - start
+                        for stage, seconds in (process_stages or {}).items():
+                            stages[f"process.{stage}"] = seconds
                         last_update_time = current_time
+                start = time.perf_counter()
                 cleanup_old_flights(session, socketio)
+                stages['cleanup'] = time.perf_counter() - start
             except Exception as e:
                 logger.error(f"Error in monitoring area {area.id}: {e}")
             finally:
                 session.close()
+        tick_duration = time.perf_counter() - tick_start
+        MONITOR_TICK_SECONDS.observe(tick_duration)
+        threshold = app.config.get('slow_tick_threshold') or frequency
+        if tick_duration > threshold:
+            record_slow_tick(area.id, tick_duration, threshold, stages)
         time.sleep(frequency)
 
 def start_monitoring_thread(app, socketio, area, selected_classifications):
-    freq_map = {'30s': 30, '1m': 60, '5m': 300}
-    frequency = freq_map.get(area.frequency, 30)
+    """
+    Start polling an area unless this or another worker already is.
+
+    Returns:
+        threading.Thread or None: The new thread, or None if the area's poller lock is taken.
+    """
+    if not acquire(AREA_LOCK, area.id):
+        # Every worker retries this every LEADERSHIP_INTERVAL, so keep it out of the dashboard log
+        logger.debug(f"Area {area.id} is already polled by another thread or worker")
+        return None
+    frequency = poll_interval(area.frequency)
     thread = threading.Thread(
         target=monitor_area,
         args=(app, socketio, area, frequency, selected_classifications),
@@ -42,6 +74,7 @@ def start_monitoring_thread(app, socketio, area, selected_classifications):
         name=f"monitor_area_{area.id}"
     )
     thread.start()
+    MONITORING_THREADS.inc()
     logger.info(f"Started monitoring thread for area {area.id} with frequency {area.frequency}")
     return thread
 
@@ -53,8 +86,9 @@ def start_monitoring(app, socketio, selected_classifications):
             for area in areas:
                 if area.id not in app.config['monitoring_threads']:
                     thread = start_monitoring_thread(app, socketio, area, selected_classifications)
-                    app.config['monitoring_threads'][area.id] = thread
-            logger.info(f"Started monitoring for {len(areas)} areas")
+                    if thread:
+                        app.config['monitoring_threads'][area.id] = thread
+            logger.debug(f"Checked monitoring for {len(areas)} areas")
         except Exception as e:
             logger.error(f"Error starting monitoring: {e}")
         finally:
@@ -0,0 +1,153 @@
+# flight_tracker/playback.py
+import time
+import numpy as np
+from flight_tracker.utils import logger
+from flight_tracker.models import db, FlightPath, FlightPosition, POSITION_BUCKET_SECONDS
+from flight_tracker.archive import query_archive
+from flight_tracker.processing import RETENTION_SECONDS
+
+MAX_GAP = 600  # Don't interpolate across gaps between reports longer than this (seconds)
+HOLD = 60  # Show a flight at its last report for this long when no later point exists
+MAX_FRAMES = 1000  # Frames returned by one range request
+
+def _load_tracks(start, end):
+    """
+    Points of every flight with a report between start and end, padded by MAX_GAP.
+
+    Reads the bucketed flight_position index, which holds every live
+    flight's whole track, and the archive for anything before the live
+    retention window, where expired flights are.
+
+    Returns:
+        tuple: (flight_id -> (n, 5) float array of [ts, lat, lon, alt, vel] sorted
+            by ts, flight_id -> classification of archived flights).
+    """
+    lo, hi = int(start) - MAX_GAP, int(end) + MAX_GAP
+    rows = (
+        db.session.query(FlightPosition.flight_id, FlightPosition.timestamp, FlightPosition.lat,
+                         FlightPosition.lon, FlightPosition.altitude, FlightPosition.velocity)
+        .filter(FlightPosition.bucket.between(lo // POSITION_BUCKET_SECONDS, hi // POSITION_BUCKET_SECONDS))
+        .filter(FlightPosition.timestamp.between(lo, hi))
+        .all()
+    )
+    grouped = {}
+    for flight_id, ts, lat, lon, alt, vel in rows:
+        grouped.setdefault(flight_id, []).append((ts, lat, lon, alt, vel))
+    archived = {}
+    # Expired flights stopped reporting before the retention cutoff; anything after it is still indexed
+    archive_end = min(hi, int(time.time()) - RETENTION_SECONDS)
+    if lo <= archive_end:
+        for flight in query_archive(start=lo, end=archive_end):
+            grouped.setdefault(flight['flight_id'], []).extend(
+                (p[2], p[0], p[1], p[3], p[4]) for p in flight['points']
+            )
+            archived[flight['flight_id']] = flight['classification']
+    tracks = {}
+    for flight_id, points in grouped.items():
+        track = np.array(points, dtype=np.float64)
+        # Sorted by ts; a point both indexed and archived (cleanup in flight) is kept once
+        _, first = np.unique(track[:, 0], return_index=True)
+        tracks[flight_id] = track[first]
+    return tracks, archived
+
+def _classifications(flight_ids, archived):
+    """Live classifications, falling back to the one archived with each expired flight."""
+    classifications = {flight_id: archived[flight_id] for flight_id in flight_ids if flight_id in archived}
+    if not flight_ids:
+        return classifications
+    rows = (
+        db.session.query(FlightPath.flight_id, FlightPath.classification)
+        .filter(FlightPath.flight_id.in_(flight_ids))
+        .all()
+    )
+    classifications.update((flight_id, c) for flight_id, c in rows if c is not None)
+    return classifications
+
+def _interpolate(track, times):
+    """
+    Positions of one flight at each of times.
+
+    Returns:
+        tuple: (mask of times the flight is visible at, (n_visible, 4) array of
+            interpolated lat, lon, alt, vel).
+    """
+    ts = track[:, 0]
+    after = np.searchsorted(ts, times, side='left')
+    before = np.searchsorted(ts, times, side='right') - 1
+    has_before = before >= 0
+    has_after = after < len(ts)
+    b = np.clip(before, 0, len(ts) - 1)
+    a = np.clip(after, 0, len(ts) - 1)
+    gap = ts[a] - ts[b]
+    bracketed = has_before & has_after & (gap <= MAX_GAP)
+    held = has_before & ~bracketed & (times - ts[b] <= HOLD)
+    visible = bracketed | held
+    weight = np.where(bracketed & (gap > 0), (times - ts[b]) / np.where(gap > 0, gap, 1), 0.0)
+    values = track[b, 1:] + weight[:, None] * (track[a, 1:] - track[b, 1:])
+    return visible, values[visible]
+
+def frames(start, end, step):
+    """
+    Interpolated positions of every aircraft from start to end every step seconds.
+
+    Args:
+        start, end (int): Time range (Unix seconds).
+        step (float): Seconds between frames.
+
+    Returns:
+        list: Frames as {'time': t, 'flights': [{flight_id, lat, lon, altitude,
+            velocity, classification}]}.
+    """
+    times = np.arange(start, end + step / 2, step, dtype=np.float64)[:MAX_FRAMES]
+    tracks, archived = _load_tracks(start, int(times[-1]))
+    classifications = _classifications(list(tracks), archived)
+    result = [{'time': float(t), 'flights': []} for t in times]
+    for flight_id, track in tracks.items():
+        visible, values = _interpolate(track, times)
+        classification = classifications.get(flight_id)
+        for frame_index, (lat, lon, alt, vel) in zip(np.flatnonzero(visible), values.tolist()):
+            result[frame_index]['flights'].append({
+                'flight_id': flight_id,
+                'lat': lat,
+                'lon': lon,
+                'altitude': alt,
+                'velocity': vel,
+                'classification': classification
+            })
+    logger.debug(f"Built {len(result)} playback frames over {len(tracks)} flights")
+    return result
+
+def positions_at(t):
+    """Interpolated positions of every aircraft at time t."""
+    return frames(t, t, 1)[0]
+
+# sid -> token of the stream currently playing to that client
+_streams = {}
+
+def stop_stream(sid):
+    _streams.pop(sid, None)
+
+def stream_frames(app, socketio, sid, start, end, step, speed, chunk=60):
+    """
+    Emit playback frames to one client, paced at step / speed seconds apart.
+
+    Frames are built a chunk at a time so long ranges start playing quickly.
+    Starting another stream for the same client, or calling stop_stream,
+    ends this one.
+    """
+    token = object()
+    _streams[sid] = token
+    t = start
+    while t <= end and _streams.get(sid) is token:
+        chunk_end = min(end, t + step * (chunk - 1))
+        with app.app_context():
+            chunk_frames = frames(t, chunk_end, step)
+        for frame in chunk_frames:
+            if _streams.get(sid) is not token:
+                return
+            socketio.emit('playback_frame', frame, to=sid)
+            socketio.sleep(step / speed)
+        t = chunk_end + step
+    if _streams.get(sid) is token:
+        del _streams[sid]
+        socketio.emit('playback_end', {'time': end}, to=sid)
@@ -2,44 +2,121 @@
 import json
 import time
 import threading
-from sqlalchemy.orm import attributes
 from flight_tracker.utils import logger
-from flight_tracker.models import db, FlightPath
-from flight_tracker.analysis import analyze_flight
-from sqlalchemy import text
+from flight_tracker.models import db, FlightPath, POSITION_BUCKET_SECONDS
+from flight_tracker.analysis import analyze_flight, reclassification_policy
+from flight_tracker.metrics import (
+    PROCESS_STAGE_SECONDS, PROCESS_SECONDS, PROCESSED_FLIGHTS, UPDATE_BUFFER_DEPTH,
+    EMIT_FLIGHTS, CLEANUP_SECONDS, CLEANED_FLIGHTS
+)
+from flight_tracker.archive import archive_flights, compact_archive
+from flight_tracker.ingest import flight_change, load_flight, submit
+from flight_tracker.coordination import broadcast
+from flight_tracker.geofence import geofence_engine, emit_events
+from flight_tracker.decimation import redundant_tail
+from sqlalchemy import bindparam, text
+
+RETENTION_SECONDS = 24 * 3600  # Flights idle longer than this leave the live table
+CLEANUP_BATCH = 1000  # Expired flight ids per flight_position delete
 
 batch_lock = threading.Lock()
 
+def _parse_points(points):
+    try:
+        parsed = json.loads(points) if points else []
+    except json.JSONDecodeError:
+        return []
+    return [p + [-1] * (5 - len(p)) for p in parsed if isinstance(p, list) and len(p) >= 3]
+
 def cleanup_old_flights(session, socketio):
-    cutoff = int(time.time()) - (24 * 3600)
+    """Move flights not updated in the last 24 hours from the live table to the archive."""
+    cutoff = int(time.time()) - RETENTION_SECONDS
+    start = time.perf_counter()
     try:
         result = session.execute(
-            text("DELETE FROM flight_path WHERE last_updated < :cutoff RETURNING flight_id"),
+            text("DELETE FROM flight_path WHERE last_updated < :cutoff "
+                 "RETURNING flight_id, points, classification, classification_source"),
             {"cutoff": cutoff}
         )
-        deleted_flight_ids = [row[0] for row in result]
+        expired = [(row[0], _parse_points(row[1]), row[2], row[3]) for row in result]
+        deleted_flight_ids = [flight[0] for flight in expired]
+        # Only the expired flights' positions: a live flight keeps its whole track indexed for playback
+        for i in range(0, len(deleted_flight_ids), CLEANUP_BATCH):
+            session.execute(
+                text("DELETE FROM flight_position WHERE bucket <= :bucket AND flight_id IN :ids").bindparams(
+                    bindparam('ids', expanding=True)),
+                {"bucket": cutoff // POSITION_BUCKET_SECONDS, "ids": deleted_flight_ids[i:i + CLEANUP_BATCH]}
+            )
+        # Archive before committing the delete so a failed write keeps the rows live
+        if expired:
+            archive_flights(expired)
         session.commit()
+        CLEANED_FLIGHTS.inc(len(deleted_flight_ids))
         logger.debug(f"Cleaned up {len(deleted_flight_ids)} old flights")
         if deleted_flight_ids:
-            socketio.emit('flight_cleanup', {'flight_ids': deleted_flight_ids})
+            reclassification_policy.forget(deleted_flight_ids)
+            broadcast(socketio, 'flight_cleanup', {'flight_ids': deleted_flight_ids})
+            EMIT_FLIGHTS.observe(len(deleted_flight_ids), event='flight_cleanup')
+        compact_archive()
     except Exception as e:
         logger.error(f"Error during cleanup: {e}")
         session.rollback()
+    finally:
+        CLEANUP_SECONDS.observe(time.perf_counter() - start)
 
 def process_states(states, socketio, selected_classifications=None):
+    """
+    Merge one poll of aircraft states into their flights, classify and emit them.
+
+    This is the producer half of ingestion: changed flights are handed to the
+    write-behind queue (see ingest.py), which commits them off the polling
+    thread, so database latency does not hold up the next poll.
+    """
     if not states or 'states' not in states or states['states'] is None:
         logger.warning(f"No valid states data to process: {states}")
         return
     
     timestamp = states['time']
     flight_updates = []
-    new_flights = []
+    changes = []
     processed_flight_ids = set()
     batch_size = 500
     update_buffer = []
+    fence_events = {}
+    # Seconds spent per stage in this call, observed once at the end to keep overhead off the loop
+    stage_time = {'lookup': 0.0, 'merge': 0.0, 'classify': 0.0, 'geofence': 0.0, 'enqueue': 0.0, 'emit': 0.0}
+    call_start = time.perf_counter()
     
     session = db.session
     
+    def flush(final):
+        nonlocal flight_updates
+        label = 'final batch' if final else 'batch'
+        start = time.perf_counter()
+        submit(changes)
+        changes.clear()
+        stage_time['enqueue'] += time.perf_counter() - start
+        
+        if update_buffer:
+            UPDATE_BUFFER_DEPTH.observe(len(update_buffer))
+            flight_updates.extend(update_buffer)
+            start = time.perf_counter()
+            while flight_updates:
+                batch = flight_updates[:100]
+                broadcast(socketio, 'flight_batch_update', {'flights': batch})
+                EMIT_FLIGHTS.observe(len(batch), event='flight_batch_update')
+                flight_updates = flight_updates[100:]
+                logger.debug(f"Sent {label} of {len(batch)} flights")
+            stage_time['emit'] += time.perf_counter() - start
+            update_buffer.clear()
+        if fence_events:
+            start = time.perf_counter()
+            emit_events(socketio, fence_events, timestamp)
+            fence_events.clear()
+            stage_time['geofence'] += time.perf_counter() - start
+        if not final:
+            socketio.sleep(0.1)
+    
     try:
         for state in states['states']:
             flight_id = state[0]
@@ -50,24 +127,37 @@ def process_states(states, socketio, selected_classifications=None):
             
             if lat is None or lon is None:
                 logger.debug(f"Skipping flight {flight_id} due to missing lat/lon")
+                PROCESSED_FLIGHTS.inc(result='no_position')
                 continue
             
             new_point = [lat, lon, timestamp, alt, vel]
             if flight_id in processed_flight_ids:
                 continue
             
-            flight = session.get(FlightPath, flight_id)
+            processed_flight_ids.add(flight_id)
+            start = time.perf_counter()
+            flight = load_flight(session, flight_id)
+            stage_time['lookup'] += time.perf_counter() - start
             if flight:
+                start = time.perf_counter()
                 current_points = flight.points_list
                 current_coords = [[p[0], p[1]] for p in current_points]
                 if [lat, lon] not in current_coords:
+                    # Classification-aware retention: the new point may replace the previous one
+                    dropped_point = current_points.pop() if redundant_tail(flight, current_points, new_point) else None
                     current_points.append(new_point)
                     current_points.sort(key=lambda p: p[2])
-                    flight.points = json.dumps(current_points)
-                    attributes.flag_modified(flight, "points")
+                    flight.set_points(current_points)
                     flight.last_updated = timestamp
-                    flight.update_stats()
+                    stage_time['merge'] += time.perf_counter() - start
+                    start = time.perf_counter()
                     analyze_flight(flight)
+                    stage_time['classify'] += time.perf_counter() - start
+                    PROCESSED_FLIGHTS.inc(result='updated')
+                    start = time.perf_counter()
+                    geofence_engine.update(flight_id, lat, lon, timestamp, fence_events)
+                    stage_time['geofence'] += time.perf_counter() - start
+                    changes.append(flight_change(flight, new_point, dropped_point))
                     if not selected_classifications or flight.classification in selected_classifications:
                         update_buffer.append({
                             'flight_id': flight.flight_id,
@@ -79,12 +169,25 @@ def process_states(states, socketio, selected_classifications=None):
                             'duration': flight.duration
                         })
                     logger.debug(f"Updated flight {flight_id} with new point")
+                else:
+                    stage_time['merge'] += time.perf_counter() - start
+                    PROCESSED_FLIGHTS.inc(result='unchanged')
+                    # Still reporting, so a parked or hovering flight isn't expired out of its fences
+                    start = time.perf_counter()
+                    geofence_engine.update(flight_id, lat, lon, timestamp, fence_events)
+                    stage_time['geofence'] += time.perf_counter() - start
             else:
+                start = time.perf_counter()
                 new_flight = FlightPath(flight_id=flight_id, points=[new_point], last_updated=timestamp)
-                new_flight.update_stats()
+                stage_time['merge'] += time.perf_counter() - start
+                start = time.perf_counter()
                 analyze_flight(new_flight)
-                new_flights.append(new_flight)
-                processed_flight_ids.add(flight_id)
+                stage_time['classify'] += time.perf_counter() - start
+                PROCESSED_FLIGHTS.inc(result='new')
+                start = time.perf_counter()
+                geofence_engine.update(flight_id, lat, lon, timestamp, fence_events)
+                stage_time['geofence'] += time.perf_counter() - start
+                changes.append(flight_change(new_flight, new_point))
                 if not selected_classifications or new_flight.classification in selected_classifications:
                     update_buffer.append({
                         'flight_id': new_flight.flight_id,
@@ -97,51 +200,25 @@ def process_states(states, socketio, selected_classifications=None):
                     })
                 logger.debug(f"Queued new flight {flight_id}")
             
-            if len(new_flights) >= batch_size or len(update_buffer) >= batch_size:
+            if len(changes) >= batch_size or len(update_buffer) >= batch_size:
                 with batch_lock:
                     try:
-                        if new_flights:
-                            session.bulk_save_objects(new_flights)
-                            session.commit()
-                            logger.info(f"Inserted {len(new_flights)} new flights")
-                            new_flights.clear()
-                        
-                        if update_buffer:
-                            flight_updates.extend(update_buffer)
-                            while flight_updates:
-                                batch = flight_updates[:100]
-                                socketio.emit('flight_batch_update', {'flights': batch})
-                                flight_updates = flight_updates[100:]
-                                logger.debug(f"Sent batch of {len(batch)} flights")
-                            session.commit()
-                            update_buffer.clear()
-                            socketio.sleep(0.1)
+                        flush(final=False)
                     except Exception as e:
                         logger.error(f"Batch processing error: {e}")
-                        session.rollback()
-                        new_flights.clear()
+                        changes.clear()
                         update_buffer.clear()
                         flight_updates.clear()
+                        fence_events.clear()
         
         with batch_lock:
             try:
-                if new_flights:
-                    session.bulk_save_objects(new_flights)
-                    session.commit()
-                    logger.info(f"Inserted {len(new_flights)} new flights")
-                    new_flights.clear()
-                
-                if update_buffer:
-                    flight_updates.extend(update_buffer)
-                    while flight_updates:
-                        batch = flight_updates[:100]
-                        socketio.emit('flight_batch_update', {'flights': batch})
-                        flight_updates = flight_updates[100:]
-                        logger.debug(f"Sent final batch of {len(batch)} flights")
-                    session.commit()
-                    update_buffer.clear()
+                flush(final=True)
             except Exception as e:
                 logger.error(f"Final batch processing error: {e}")
-                session.rollback()
     finally:
-        session.close()
\ No newline at end of file
+        session.close()
+        for stage, seconds in stage_time.items():
+            PROCESS_STAGE_SECONDS.observe(seconds, stage=stage)
+        PROCESS_SECONDS.observe(time.perf_counter() - call_start)
+    return stage_time
@@ -0,0 +1,130 @@
+# flight_tracker/profiling.py
+import collections
+import gc
+import sys
+import threading
+import time
+from flight_tracker.utils import logger
+
+MAX_PROFILE_SECONDS = 60
+SLOW_TICK_HISTORY = 50  # Slow monitoring ticks kept for /admin/slow_ticks
+
+slow_ticks = collections.deque(maxlen=SLOW_TICK_HISTORY)
+_profile_lock = threading.Lock()
+
+def _native_thread_class():
+    """The real OS thread class, even when gevent has monkey patched threading."""
+    try:
+        from gevent import monkey
+        return monkey.get_original('threading', 'Thread')
+    except ImportError:
+        return threading.Thread
+
+def _native_sleep():
+    try:
+        from gevent import monkey
+        return monkey.get_original('time', 'sleep')
+    except ImportError:
+        return time.sleep
+
+def _greenlets():
+    try:
+        import greenlet
+    except ImportError:
+        return []
+    return [obj for obj in gc.get_objects() if isinstance(obj, greenlet.greenlet) and obj.gr_frame is not None]
+
+def _collapse(frame):
+    stack = []
+    while frame is not None:
+        code = frame.f_code
+        stack.append(f"{code.co_filename.rsplit('/', 1)[-1]}:{code.co_name}")
+        frame = frame.f_back
+    return ';'.join(reversed(stack))
+
+def sample_stacks(seconds, interval=0.01):
+    """
+    Sample the stacks of every thread and suspended greenlet.
+
+    Args:
+        seconds (float): How long to sample for.
+        interval (float): Seconds between samples.
+
+    Returns:
+        Counter: Collapsed stacks ("root;...;leaf") mapped to sample counts,
+            prefixed with the thread name or "greenlet".
+    """
+    stacks = collections.Counter()
+    sleep = _native_sleep()
+    own_ident = threading.get_ident()
+    names = {}
+    greenlets = []
+    greenlets_refreshed = 0
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        now = time.perf_counter()
+        # Finding greenlets walks the heap, so only refresh the list once a second
+        if now - greenlets_refreshed >= 1:
+            greenlets = _greenlets()
+            names = {t.ident: t.name for t in threading.enumerate()}
+            greenlets_refreshed = now
+        for ident, frame in sys._current_frames().items():
+            if ident != own_ident:
+                stacks[f"{names.get(ident, ident)};{_collapse(frame)}"] += 1
+        for g in greenlets:
+            frame = g.gr_frame
+            if frame is not None:
+                stacks[f"greenlet;{_collapse(frame)}"] += 1
+        sleep(interval)
+    return stacks
+
+def profile(seconds, interval=0.01):
+    """
+    Run the sampler on a native thread and wait for it cooperatively.
+
+    Sampling from a native thread keeps it running while a greenlet hogs the
+    hub, which is exactly the stall we want to see.
+
+    Returns:
+        str or None: Collapsed stacks, one "stack count" per line (flamegraph.pl
+            and speedscope format), or None if a profile is already running.
+    """
+    if not _profile_lock.acquire(blocking=False):
+        return None
+    try:
+        seconds = min(seconds, MAX_PROFILE_SECONDS)
+        result = {}
+
+        def run():
+            result['stacks'] = sample_stacks(seconds, interval)
+
+        sampler = _native_thread_class()(target=run, daemon=True, name="profiler")
+        sampler.start()
+        while 'stacks' not in result and sampler.is_alive():
+            time.sleep(0.1)
+        stacks = result.get('stacks', collections.Counter())
+        logger.info(f"Profiled {seconds}s: {sum(stacks.values())} samples, {len(stacks)} distinct stacks")
+        return ''.join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+    finally:
+        _profile_lock.release()
+
+def record_slow_tick(area_id, duration, threshold, stages):
+    """
+    Keep and log the per-stage breakdown of a monitoring tick that overran.
+
+    Args:
+        area_id (int): Area the tick belonged to.
+        duration (float): Tick wall time in seconds.
+        threshold (float): The threshold it exceeded.
+        stages (dict): Seconds per stage.
+    """
+    tick = {
+        'area_id': area_id,
+        'started_at': time.time() - duration,
+        'duration': duration,
+        'threshold': threshold,
+        'stages': {stage: round(seconds, 6) for stage, seconds in stages.items()}
+    }
+    slow_ticks.append(tick)
+    breakdown = ', '.join(f"{stage}={seconds:.3f}s" for stage, seconds in sorted(stages.items(), key=lambda s: -s[1]))
+    logger.warning(f"Slow monitoring tick for area {area_id}: {duration:.3f}s > {threshold:.3f}s ({breakdown})")
@@ -1,11 +1,18 @@
 # flight_tracker/routes.py
-from flask import render_template, request, jsonify
+import json
+from flask import render_template, request, jsonify, Response
 from flight_tracker.utils import logger
-from flight_tracker.models import db, MonitoredArea, FlightPath, Classification
+from flight_tracker.models import db, MonitoredArea, FlightPath, Classification, Geofence
 from flight_tracker.monitoring import start_monitoring_thread
-from flight_tracker.ml_model import train_model
-from flight_tracker.analysis import analyze_flight
-from sklearn.utils.validation import check_is_fitted
+from flight_tracker.ml_model import start_retrain, is_retraining, get_active_model
+from flight_tracker.analysis import reclassification_policy
+from flight_tracker.metrics import registry
+from flight_tracker.profiling import profile, slow_ticks
+from flight_tracker.archive import query_archive
+from flight_tracker.playback import frames, positions_at, MAX_FRAMES
+from flight_tracker.coordination import broadcast, control
+from flight_tracker.similarity import trajectory_index
+from flight_tracker.geofence import Fence, geofence_engine
 
 def register_routes(app, socketio):
     @app.route('/add_area', methods=['POST'])
@@ -21,6 +28,7 @@ def register_routes(app, socketio):
         )
         db.session.add(area)
         db.session.commit()
+        control('geofences', None)
         return jsonify({'message': f'Area {area.id} added', 'area_id': area.id})
 
     @app.route('/')
@@ -42,6 +50,7 @@ def register_routes(app, socketio):
         area = MonitoredArea(lamin=lamin, lamax=lamax, lomin=lomin, lomax=lomax, frequency=frequency, is_monitoring=True)
         db.session.add(area)
         db.session.commit()
+        control('geofences', None)
         start_monitoring_thread(app, socketio, area, app.config['selected_classifications'])
         logger.info(f"Started monitoring for area ID {area.id}")
         return jsonify({'message': 'Monitoring started', 'area_id': area.id}), 200
@@ -60,6 +69,7 @@ def register_routes(app, socketio):
             area.is_monitoring = True
             area.frequency = frequency
             db.session.commit()
+            control('geofences', None)
             start_monitoring_thread(app, socketio, area, app.config['selected_classifications'])
             logger.info(f"Started monitoring for area ID {area.id}")
         return jsonify({'message': 'Monitoring started', 'area_id': area.id}), 200
@@ -77,6 +87,7 @@ def register_routes(app, socketio):
             if area.is_monitoring:
                 area.is_monitoring = False
                 db.session.commit()
+                control('geofences', None)
                 logger.info(f"Stopped monitoring for area ID {area_id}")
             return jsonify({'message': 'Monitoring stopped', 'area_id': area_id}), 200
         logger.warning(f"Area ID {area_id} not found for stop_monitoring, possibly already deleted")
@@ -172,7 +183,7 @@ def register_routes(app, socketio):
             flight.auto_classified = False
             flight.classification_source = 'manual'
             db.session.commit()
-            socketio.emit('flight_update', {
+            broadcast(socketio, 'flight_update', {
                 'flight_id': flight.flight_id,
                 'points': flight.points_list,
                 'classification': flight.classification,
@@ -186,10 +197,9 @@ def register_routes(app, socketio):
 
     @app.route('/retrain_model', methods=['POST'])
     def retrain_model_endpoint():
-        success = train_model()
-        if success:
-            return jsonify({'message': 'Model retrained successfully'}), 200
-        return jsonify({'error': 'Failed to retrain model (insufficient data or error)'}), 400
+        if not start_retrain(app.config['SQLALCHEMY_DATABASE_URI']):
+            return jsonify({'error': 'Model retraining already in progress'}), 409
+        return jsonify({'message': 'Model retraining started'}), 202
 
     @app.route('/delete_area', methods=['POST'])
     def delete_area():
@@ -203,6 +213,7 @@ def register_routes(app, socketio):
         if area:
             db.session.delete(area)
             db.session.commit()
+            control('geofences', None)
             logger.info(f"Deleted area ID {area_id}")
             return jsonify({'message': 'Area deleted', 'area_id': area_id}), 200
         logger.warning(f"Area ID {area_id} not found for deletion")
@@ -219,6 +230,7 @@ def register_routes(app, socketio):
         if area:
             area.name = name
             db.session.commit()
+            control('geofences', None)
             logger.info(f"Area {area_id} renamed to {name}")
             return jsonify({'message': 'Area name updated'}), 200
         return jsonify({'error': 'Area not found'}), 404
@@ -245,6 +257,37 @@ def register_routes(app, socketio):
         logger.debug(f"Area {area_id} classifications: {classifications}")
         return jsonify(classifications)
 
+    @app.route('/geofences', methods=['GET'])
+    def get_geofences():
+        return jsonify(geofence_engine.snapshot())
+
+    @app.route('/add_geofence', methods=['POST'])
+    def add_geofence():
+        data = request.get_json()
+        polygon = data.get('polygon')
+        try:
+            Fence.from_polygon(None, None, polygon)
+        except (TypeError, ValueError, IndexError):
+            return jsonify({'error': 'polygon must be at least 3 [lat, lon] points'}), 400
+        geofence = Geofence(name=data.get('name'), polygon=json.dumps([[float(p[0]), float(p[1])] for p in polygon]))
+        db.session.add(geofence)
+        db.session.commit()
+        control('geofences', None)
+        logger.info(f"Added geofence {geofence.id}")
+        return jsonify({'message': 'Geofence added', 'geofence_id': geofence.id, 'fence': f"polygon:{geofence.id}"})
+
+    @app.route('/delete_geofence', methods=['POST'])
+    def delete_geofence():
+        geofence_id = request.get_json().get('geofence_id')
+        geofence = db.session.get(Geofence, geofence_id) if geofence_id else None
+        if not geofence:
+            return jsonify({'error': 'Geofence not found'}), 404
+        db.session.delete(geofence)
+        db.session.commit()
+        control('geofences', None)
+        logger.info(f"Deleted geofence {geofence_id}")
+        return jsonify({'message': 'Geofence deleted', 'geofence_id': geofence_id})
+
     @app.route('/classifications', methods=['GET'])
     def get_classifications():
         classifications = Classification.query.all()
@@ -272,10 +315,14 @@ def register_routes(app, socketio):
         classes = len(set(f.classification for f in flights))
         retrainRecommended = samples >= 10 and classes > 1
         # Use check_is_fitted to determine if the model is trained
+        active = get_active_model()
         status = 'Not loaded'
-        if hasattr(analyze_flight, 'model') and analyze_flight.model is not None:
+        if active['forest'] is not None:
+            status = 'Trained'
+        elif active['model'] is not None:
             try:
-                check_is_fitted(analyze_flight.model)
+                from sklearn.utils.validation import check_is_fitted
+                check_is_fitted(active['model'])
                 status = 'Trained'
             except:
                 status = 'Loaded but not trained'
@@ -283,5 +330,109 @@ def register_routes(app, socketio):
             'status': status,
             'samples': samples,
             'classes': classes,
-            'retrainRecommended': retrainRecommended
-        })
\ No newline at end of file
+            'retrainRecommended': retrainRecommended,
+            'version': active['version'],
+            'trainedAt': active['trained_at'],
+            'trainedSamples': active['samples'],
+            'retraining': is_retraining(),
+            'reclassification': reclassification_policy.stats()
+        })
+
+    @app.route('/metrics', methods=['GET'])
+    def get_metrics():
+        return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+    @app.route('/admin/profile', methods=['GET'])
+    def admin_profile():
+        try:
+            seconds = float(request.args.get('seconds', 10))
+            interval = float(request.args.get('interval', 0.01))
+        except ValueError:
+            return jsonify({'error': 'seconds and interval must be numbers'}), 400
+        if seconds <= 0 or interval <= 0:
+            return jsonify({'error': 'seconds and interval must be positive'}), 400
+        stacks = profile(seconds, interval)
+        if stacks is None:
+            return jsonify({'error': 'A profile is already running'}), 409
+        return Response(stacks, mimetype='text/plain',
+                        headers={'Content-Disposition': 'attachment; filename=profile.collapsed'})
+
+    @app.route('/admin/slow_ticks', methods=['GET'])
+    def admin_slow_ticks():
+        return jsonify(list(slow_ticks))
+
+    @app.route('/archive/flights', methods=['GET'])
+    def get_archived_flights():
+        try:
+            start = request.args.get('start', type=int)
+            end = request.args.get('end', type=int)
+            limit = int(request.args.get('limit', 1000))
+            bbox = None
+            if all(request.args.get(k) is not None for k in ('lamin', 'lamax', 'lomin', 'lomax')):
+                bbox = tuple(float(request.args[k]) for k in ('lamin', 'lamax', 'lomin', 'lomax'))
+        except ValueError:
+            return jsonify({'error': 'Invalid numeric parameter'}), 400
+        flights = query_archive(
+            start=start,
+            end=end,
+            bbox=bbox,
+            classifications=request.args.getlist('classifications') or None,
+            flight_ids=request.args.getlist('flight_id') or None,
+            limit=limit
+        )
+        logger.debug(f"Returning {len(flights)} archived flights")
+        return jsonify({'flights': flights, 'count': len(flights)})
+
+    @app.route('/playback', methods=['GET'])
+    def get_playback():
+        try:
+            t = request.args.get('t', type=float)
+            start = request.args.get('start', type=float)
+            end = request.args.get('end', type=float)
+            step = request.args.get('step', 10, type=float)
+        except ValueError:
+            return jsonify({'error': 'Invalid numeric parameter'}), 400
+        if t is not None:
+            return jsonify(positions_at(t))
+        if start is None or end is None or step <= 0 or end < start:
+            return jsonify({'error': 'Provide t, or start <= end and a positive step'}), 400
+        if (end - start) / step >= MAX_FRAMES:
+            return jsonify({'error': f'Range covers more than {MAX_FRAMES} frames, use a larger step'}), 400
+        return jsonify({'frames': frames(start, end, step)})
+
+    @app.route('/similar_flights', methods=['GET', 'POST'])
+    def get_similar_flights():
+        data = request.get_json(silent=True) or {}
+        flight_id = data.get('flight_id') or request.args.get('flight_id')
+        metric = data.get('metric') or request.args.get('metric', 'dtw')
+        try:
+            k = int(data.get('k') or request.args.get('k', 10))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'Invalid k'}), 400
+        if metric not in ('dtw', 'frechet') or not 1 <= k <= 100:
+            return jsonify({'error': "metric must be 'dtw' or 'frechet' and k between 1 and 100"}), 400
+        if flight_id:
+            flight = FlightPath.query.get(flight_id)
+            if not flight:
+                return jsonify({'error': 'Flight not found'}), 404
+            matches = trajectory_index.search(flight.points_array, k=k, metric=metric, exclude=flight_id)
+        else:
+            path = data.get('path')
+            try:
+                path = [[float(p[0]), float(p[1])] for p in path]
+            except (TypeError, ValueError, IndexError):
+                return jsonify({'error': 'Provide a flight_id or a path of [lat, lon] points'}), 400
+            # A drawn path has no altitude, speed or timing to compare features on
+            matches = trajectory_index.search(path, k=k, metric=metric, use_features=False)
+        flights = {f.flight_id: f for f in FlightPath.query.filter(FlightPath.flight_id.in_([m[0] for m in matches]))}
+        return jsonify({'flights': [
+            {
+                'flight_id': match_id,
+                'distance': distance,
+                'classification': flights[match_id].classification,
+                'avg_altitude': flights[match_id].avg_altitude,
+                'avg_velocity': flights[match_id].avg_velocity,
+                'duration': flights[match_id].duration
+            }
+            for match_id, distance in matches if match_id in flights
+        ], 'indexed': len(trajectory_index)})
@@ -0,0 +1,354 @@
+# flight_tracker/similarity.py
+import os
+import threading
+import time
+import numpy as np
+from sqlalchemy import select
+from flight_tracker.utils import logger
+from flight_tracker.models import db, FlightPath
+from flight_tracker.features import feature_vector
+from flight_tracker.metrics import SIMILARITY_SECONDS, SIMILARITY_INDEXED
+from flight_tracker.coordination import SIMILARITY_LOCK, acquire, holds
+
+INDEX_PATH = '/data/similarity_index.npz'
+SIGNATURE_POINTS = 32  # Points each track is resampled to
+MIN_POINTS = 5  # Shorter tracks have no meaningful shape and are not indexed
+FEATURE_WEIGHT = 0.5  # Weight of the standardized extract_features vector against the shape signature
+CANDIDATES = 200  # Tracks refined with DTW/Fréchet per query (at least 20 * k)
+REFRESH_INTERVAL = 60  # Seconds between pulls of updated flights into the index
+RETENTION_SECONDS = 24 * 3600  # Matches the live table; older rows are dropped on refresh
+REFRESH_BATCH = 2000
+REINDEX_SECONDS = 300  # A live flight's shape is recomputed at most this often; a few minutes of track barely moves it
+# Updated flights are re-read this far behind the newest last_updated seen, so rows the
+# write-behind queue commits late (with an older last_updated) are still picked up
+WATERMARK_MARGIN = 600
+YIELD_EVERY = 50  # Flights signed between pauses, so a cold build doesn't starve polling and sockets
+# sleep(0) only switches to greenlets already runnable; a short real sleep lets the gevent hub run timers and I/O
+YIELD_SECONDS = 0.001
+
+def _resample(latlon, m=SIGNATURE_POINTS):
+    """Resample a (n, 2) lat/lon track to m points evenly spaced along its length."""
+    xy = np.column_stack((latlon[:, 1] * np.cos(np.radians(latlon[:, 0].mean())), latlon[:, 0]))
+    steps = np.hypot(*np.diff(xy, axis=0).T)
+    distance = np.concatenate(([0.0], np.cumsum(steps)))
+    if distance[-1] <= 0:
+        return None
+    targets = np.linspace(0, distance[-1], m)
+    return np.column_stack((np.interp(targets, distance, xy[:, 0]), np.interp(targets, distance, xy[:, 1])))
+
+def signature(latlon):
+    """
+    Position-, scale- and rotation-free shape of a track.
+
+    The resampled track is centred, rotated onto its principal axes and
+    scaled to unit RMS radius, so the same survey pattern matches wherever
+    and at whatever heading it was flown.
+
+    Returns:
+        np.ndarray or None: (SIGNATURE_POINTS, 2) float32 array, or None for degenerate tracks.
+    """
+    latlon = np.asarray(latlon, dtype=np.float64)[:, :2]
+    if len(latlon) < 2:
+        return None
+    xy = _resample(latlon)
+    if xy is None:
+        return None
+    xy -= xy.mean(axis=0)
+    _, vectors = np.linalg.eigh(np.cov(xy.T) + 1e-12 * np.eye(2))
+    xy = xy @ vectors[:, ::-1]
+    scale = np.sqrt((xy ** 2).sum(axis=1).mean())
+    if scale <= 0:
+        return None
+    return (xy / scale).astype(np.float32)
+
+def _variants(sig):
+    """The query's mirror images and reversal, which principal-axis alignment can't tell apart."""
+    flips = [sig * np.array(f, dtype=np.float32) for f in ((1, 1), (-1, 1), (1, -1), (-1, -1))]
+    return np.stack(flips + [f[::-1] for f in flips])
+
+def _warp_distance(query, candidates, metric='dtw'):
+    """
+    DTW or discrete Fréchet distance between each query/candidate pair, vectorized over pairs.
+
+    Args:
+        query (np.ndarray): (c, m, 2) query per candidate.
+        candidates (np.ndarray): (c, m, 2) candidate signatures.
+
+    Returns:
+        np.ndarray: (c,) distances; DTW is divided by m so both metrics are per-point scale.
+    """
+    cost = np.linalg.norm(query[:, :, None, :] - candidates[:, None, :, :], axis=3)
+    m = cost.shape[1]
+    acc = np.full((cost.shape[0], m + 1, m + 1), np.inf, dtype=np.float64)
+    acc[:, 0, 0] = 0
+    combine = np.add if metric == 'dtw' else np.maximum
+    for i in range(1, m + 1):
+        for j in range(1, m + 1):
+            best = np.minimum(np.minimum(acc[:, i - 1, j], acc[:, i, j - 1]), acc[:, i - 1, j - 1])
+            acc[:, i, j] = combine(cost[:, i - 1, j - 1], best)
+    result = acc[:, m, m]
+    return result / m if metric == 'dtw' else result
+
+class TrajectoryIndex:
+    """
+    In-memory index of every live flight's shape signature and feature vector.
+
+    A query is a linear scan over one contiguous float32 matrix (the
+    signature scaled to per-point units next to the standardized features),
+    keeping the closest CANDIDATES, which are then re-ranked by DTW or
+    discrete Fréchet distance. The index is refreshed from flights updated
+    since the last pull and saved to INDEX_PATH so restarts don't rebuild it.
+    """
+
+    def __init__(self):
+        self.ids = []
+        self.rows = {}
+        self.signatures = np.zeros((0, SIGNATURE_POINTS, 2), dtype=np.float32)
+        self.features = np.zeros((0, 8), dtype=np.float32)
+        self.updated = np.zeros(0, dtype=np.int64)
+        self.indexed = np.zeros(0, dtype=np.int64)  # last_updated each row's signature was computed at
+        self.watermark = 0
+        self._unindexable = {}  # flight_id -> [checked, updated] last_updated of tracks too short or degenerate to sign
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.ids)
+
+    def add(self, entries):
+        """
+        Insert or replace index rows.
+
+        Args:
+            entries (list): (flight_id, points_array, last_updated) tuples.
+        """
+        computed = []
+        for i, (flight_id, points, last_updated) in enumerate(entries):
+            if i and i % YIELD_EVERY == 0:
+                time.sleep(YIELD_SECONDS)
+            sig = signature(points) if len(points) >= MIN_POINTS else None
+            if sig is None:
+                self._unindexable[flight_id] = [last_updated, last_updated]
+                continue
+            self._unindexable.pop(flight_id, None)
+            computed.append((flight_id, sig, feature_vector(points).astype(np.float32), last_updated))
+        new_ids, new_sigs, new_feats, new_updated = [], [], [], []
+        with self._lock:
+            for flight_id, sig, feats, last_updated in computed:
+                row = self.rows.get(flight_id)
+                if row is not None:
+                    self.signatures[row] = sig
+                    self.features[row] = feats
+                    self.updated[row] = last_updated
+                    self.indexed[row] = last_updated
+                elif flight_id not in new_ids:
+                    new_ids.append(flight_id)
+                    new_sigs.append(sig)
+                    new_feats.append(feats)
+                    new_updated.append(last_updated)
+            if new_ids:
+                for flight_id in new_ids:
+                    self.rows[flight_id] = len(self.ids)
+                    self.ids.append(flight_id)
+                self.signatures = np.concatenate((self.signatures, np.stack(new_sigs)))
+                self.features = np.concatenate((self.features, np.stack(new_feats)))
+                self.updated = np.concatenate((self.updated, np.array(new_updated, dtype=np.int64)))
+                self.indexed = np.concatenate((self.indexed, np.array(new_updated, dtype=np.int64)))
+        SIMILARITY_INDEXED.set(len(self.ids))
+
+    def prune(self, cutoff):
+        """Drop flights last updated before cutoff, as cleanup_old_flights does."""
+        with self._lock:
+            keep = self.updated >= cutoff
+            if keep.all():
+                return
+            self.ids = [flight_id for flight_id, k in zip(self.ids, keep) if k]
+            self.rows = {flight_id: row for row, flight_id in enumerate(self.ids)}
+            self.signatures = self.signatures[keep]
+            self.features = self.features[keep]
+            self.updated = self.updated[keep]
+            self.indexed = self.indexed[keep]
+        for flight_id in [f for f, (_, updated) in self._unindexable.items() if updated < cutoff]:
+            del self._unindexable[flight_id]
+        SIMILARITY_INDEXED.set(len(self.ids))
+
+    def refresh(self, session):
+        """
+        Index flights updated since the last refresh and drop expired ones.
+
+        Only ids and timestamps are read for every updated flight. Points are
+        fetched and re-signed only for flights that are new to the index,
+        whose signature is REINDEX_SECONDS behind, or that have gone idle
+        (no update for REFRESH_INTERVAL) since they were last signed, so the
+        final shape of every flight is indexed. The rest just have their last
+        update moved forward so pruning keeps them.
+
+        Returns:
+            int: Number of index rows changed.
+        """
+        start = time.perf_counter()
+        changed = session.execute(
+            select(FlightPath.flight_id, FlightPath.last_updated)
+            .where(FlightPath.last_updated >= self.watermark - WATERMARK_MARGIN)
+        ).all()
+        stale, touched = set(), 0
+        idle_before = int(time.time()) - REFRESH_INTERVAL
+        with self._lock:
+            for flight_id, last_updated in changed:
+                row = self.rows.get(flight_id)
+                if row is not None:
+                    checked, updated = self.indexed[row], self.updated[row]
+                elif flight_id in self._unindexable:
+                    checked, updated = self._unindexable[flight_id]
+                else:
+                    stale.add(flight_id)
+                    continue
+                if last_updated - checked >= REINDEX_SECONDS:
+                    stale.add(flight_id)
+                elif last_updated > updated:
+                    if row is not None:
+                        self.updated[row] = last_updated
+                    else:
+                        self._unindexable[flight_id][1] = last_updated
+                    touched += 1
+            idle = (self.updated != self.indexed) & (self.updated < idle_before)
+            stale.update(self.ids[row] for row in np.flatnonzero(idle))
+            stale.update(flight_id for flight_id, (checked, updated) in self._unindexable.items()
+                         if checked != updated and updated < idle_before)
+        stale = list(stale)
+        # Reuses FlightPath's decoding and normalization without building an ORM object per row
+        decoder = FlightPath('')
+        for i in range(0, len(stale), REFRESH_BATCH):
+            batch = []
+            for flight_id, points, last_updated in session.execute(
+                select(FlightPath.flight_id, FlightPath.points, FlightPath.last_updated)
+                .where(FlightPath.flight_id.in_(stale[i:i + REFRESH_BATCH]))
+            ):
+                decoder.flight_id, decoder.points = flight_id, points
+                try:
+                    batch.append((flight_id, decoder.points_array, last_updated))
+                except (ValueError, TypeError):
+                    continue
+            self.add(batch)
+        if changed:
+            self.watermark = max(self.watermark, max(last_updated for _, last_updated in changed))
+        self.prune(int(time.time()) - RETENTION_SECONDS)
+        logger.debug(f"Similarity index refreshed: {len(changed)} updated flights, {len(stale)} re-signed "
+                     f"in {time.perf_counter() - start:.2f}s")
+        return len(stale) + touched
+
+    def search(self, points, k=10, metric='dtw', exclude=None, use_features=True):
+        """
+        The k indexed flights whose tracks are most similar to points.
+
+        Args:
+            points (list or np.ndarray): [lat, lon, ...] points of the query track.
+            k (int): Number of results.
+            metric (str): 'dtw' or 'frechet' for the refinement step.
+            exclude (str, optional): Flight id to leave out (the query flight itself).
+            use_features (bool): Also compare extract_features vectors; off for
+                drawn paths, which have no altitude, speed or timing.
+
+        Returns:
+            list: (flight_id, distance) tuples, closest first.
+        """
+        query_sig = signature(points)
+        if query_sig is None:
+            return []
+        with self._lock:
+            ids, rows, signatures, features = self.ids, self.rows, self.signatures, self.features
+        if not ids:
+            return []
+        with SIMILARITY_SECONDS.time(stage='scan'):
+            n = len(ids)
+            variants = _variants(query_sig).reshape(8, -1) / np.sqrt(SIGNATURE_POINTS)
+            flat = signatures.reshape(n, -1) / np.sqrt(SIGNATURE_POINTS)
+            # Squared distance to every variant via one matrix product; keep the best variant per flight
+            sig_dist = (flat ** 2).sum(axis=1)[:, None] - 2 * flat @ variants.T + (variants ** 2).sum(axis=1)[None, :]
+            best_variant = sig_dist.argmin(axis=1)
+            distance = sig_dist[np.arange(n), best_variant]
+            feature_dist = np.zeros(n, dtype=np.float32)
+            if use_features:
+                mean, std = features.mean(axis=0), features.std(axis=0) + 1e-6
+                query_features = (feature_vector(points).astype(np.float32) - mean) / std
+                feature_dist = (((features - mean) / std - query_features) ** 2).mean(axis=1) * FEATURE_WEIGHT
+                distance = distance + feature_dist
+            if exclude in rows:
+                distance[rows[exclude]] = np.inf
+            count = min(n, max(CANDIDATES, 20 * k))
+            candidates = np.argpartition(distance, count - 1)[:count] if count < n else np.arange(n)
+            candidates = candidates[np.isfinite(distance[candidates])]
+        with SIMILARITY_SECONDS.time(stage='refine'):
+            queries = _variants(query_sig)[best_variant[candidates]]
+            refined = _warp_distance(queries, signatures[candidates], metric) + feature_dist[candidates]
+            order = np.argsort(refined)[:k]
+        return [(ids[candidates[i]], float(refined[i])) for i in order]
+
+    def save(self, path=INDEX_PATH):
+        with self._lock:
+            ids, signatures, features, updated, indexed = self.ids, self.signatures, self.features, self.updated, self.indexed
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp.{os.getpid()}.npz"
+        np.savez(tmp_path, ids=np.array(ids, dtype=object), signatures=signatures,
+                 features=features, updated=updated, indexed=indexed, watermark=self.watermark)
+        os.replace(tmp_path, path)
+
+    def load(self, path=INDEX_PATH):
+        if not os.path.exists(path):
+            return False
+        try:
+            with np.load(path, allow_pickle=True) as data:
+                if data['signatures'].shape[1:] != (SIGNATURE_POINTS, 2):
+                    return False
+                ids = list(data['ids'])
+                with self._lock:
+                    self.ids = ids
+                    self.rows = {flight_id: row for row, flight_id in enumerate(ids)}
+                    self.signatures = data['signatures']
+                    self.features = data['features']
+                    self.updated = data['updated']
+                    self.indexed = data['indexed'] if 'indexed' in data.files else data['updated'].copy()
+                    self.watermark = int(data['watermark'])
+        except Exception as e:
+            logger.error(f"Failed to load similarity index {path}: {e}")
+            return False
+        SIMILARITY_INDEXED.set(len(self.ids))
+        logger.info(f"Loaded similarity index with {len(self.ids)} flights")
+        return True
+
+trajectory_index = TrajectoryIndex()
+
+def _maintain_index(app):
+    """
+    Keep trajectory_index current.
+
+    The worker holding SIMILARITY_LOCK refreshes and saves the index; the
+    others only reload INDEX_PATH when it changes, so the index is built
+    once rather than once per worker.
+    """
+    trajectory_index.load()
+    loaded = _index_mtime()
+    while True:
+        try:
+            if holds(SIMILARITY_LOCK, 0) or acquire(SIMILARITY_LOCK, 0):
+                with app.app_context():
+                    if trajectory_index.refresh(db.session):
+                        trajectory_index.save()
+                        loaded = _index_mtime()
+                    db.session.close()
+            elif _index_mtime() != loaded:
+                loaded = _index_mtime()
+                trajectory_index.load()
+        except Exception as e:
+            logger.error(f"Similarity index refresh failed: {e}")
+        time.sleep(REFRESH_INTERVAL)
+
+def _index_mtime(path=INDEX_PATH):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+def start_similarity_index(app):
+    thread = threading.Thread(target=_maintain_index, args=(app,), daemon=True, name="similarity_index")
+    thread.start()
+    return thread
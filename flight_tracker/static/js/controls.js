@@ -261,7 +261,10 @@ function updateMLStats() {
             return response.json();
         })
         .then(data => {
-            document.getElementById('ml-status').textContent = data.status || 'Not loaded';
+            document.getElementById('ml-status').textContent = data.retraining ? 'Retraining...' : (data.status || 'Not loaded');
+            document.getElementById('ml-version').textContent = data.version
+                ? `v${data.version} (${data.trainedSamples} samples, ${new Date(data.trainedAt * 1000).toLocaleString()})`
+                : '-';
             document.getElementById('ml-samples').textContent = data.samples || 0;
             document.getElementById('ml-classes').textContent = data.classes || 0;
             document.getElementById('ml-retrain').textContent = data.retrainRecommended ? 'Yes' : 'No';
@@ -1,5 +1,6 @@
 // flight_tracker/static/js/socket.js
-const socket = io();
+// Websocket only: several server workers sit behind one port without sticky sessions
+const socket = io({ transports: ['websocket'] });
 
 function setupSocketEvents(map) {
     if (!map) {
@@ -45,6 +46,14 @@ function setupSocketEvents(map) {
         updateFlightList();
     });
 
+    socket.on('area_enter', (data) => {
+        appendLog(`${data.flight_ids.length} aircraft entered ${data.name || data.fence} (${data.count} inside)`);
+    });
+
+    socket.on('area_exit', (data) => {
+        appendLog(`${data.flight_ids.length} aircraft left ${data.name || data.fence} (${data.count} inside)`);
+    });
+
     socket.on('disconnect', () => console.log('Disconnected from server'));
     socket.on('error', (err) => console.error('WebSocket error:', err));
 }
\ No newline at end of file
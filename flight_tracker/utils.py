@@ -1,5 +1,4 @@
 import logging
-from flask_socketio import SocketIO
 
 logger = logging.getLogger(__name__)
 